@@ -1,55 +1,326 @@
+import os
 import time
 import json
+from contextlib import contextmanager
+from contextvars import ContextVar
 import numpy as np
 from pathlib import Path
 
+
+class Run:
+    """
+    The values, counters, gauges, histograms, timers and series of one benchmark run
+    """
+
+    id: str
+    info: dict
+    counters: dict[str, int | float]
+    gauges: dict[str, list]  # [sum, min, max, count] per key.
+    histograms: dict[str, dict[int, int]]
+    timers: dict[str, list]  # [total ns, count, histogram] per key.
+    series: dict[str, list]
+
+    def __init__(self, id: str) -> None:
+        self.id = id
+        self.info = {"start": time.time_ns()}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.timers = {}
+        self.series = {}
+
+    def merge(self, other: "Run"):
+        """Fold the counters, gauges and series of other into this run"""
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+        for key, (total, low, high, count) in other.gauges.items():
+            stats = self.gauges.get(key)
+            if stats is None:
+                self.gauges[key] = [total, low, high, count]
+            else:
+                stats[0] += total
+                stats[1] = min(stats[1], low)
+                stats[2] = max(stats[2], high)
+                stats[3] += count
+
+        for key, histogram in other.histograms.items():
+            counts = self.histograms.setdefault(key, {})
+            for value, n in histogram.items():
+                counts[value] = counts.get(value, 0) + n
+
+        for key, (total, count, histogram) in other.timers.items():
+            stats = self.timers.setdefault(key, [0, 0, {}])
+            stats[0] += total
+            stats[1] += count
+            for bucket, n in histogram.items():
+                stats[2][bucket] = stats[2].get(bucket, 0) + n
+
+        for key, values in other.series.items():
+            self.series.setdefault(key, []).extend(values)
+
+    def export(self) -> dict:
+        """All data of the run as one flat dict, as written to the JSON output"""
+        data = dict(self.info)
+        data.update(self.counters)
+        data.update(self.series)
+        for key, (total, low, high, count) in self.gauges.items():
+            prefix, unit = key
+            data[f"{prefix}_total_{unit}"] = total
+            data[f"{prefix}_min_{unit}"] = low
+            data[f"{prefix}_max_{unit}"] = high
+            data[f"{prefix}_total_iterations"] = count
+            data[f"{prefix}_avg_{unit}"] = total / count
+        for key, histogram in self.histograms.items():
+            data[f"{key}_histogram"] = dict(sorted(histogram.items()))
+        for key, (total, count, histogram) in self.timers.items():
+            data[f"time_{key}_ns"] = total
+            data[f"time_{key}_count"] = count
+            data[f"time_{key}_histogram"] = dict(sorted(histogram.items()))
+        return data
+
+
+class Counter:
+    """A sum kept by the current run, declared once by the code it counts"""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+
+    def add(self, amount: int | float = 1):
+        run = CURRENT.get()
+        if run is None:
+            return
+
+        run.counters[self.key] = run.counters.get(self.key, 0) + amount
+
+
+class Gauge:
+    """The sum, minimum, maximum and count of the values observed in the current run"""
+
+    __slots__ = ("key",)
+
+    def __init__(self, prefix: str, unit: str) -> None:
+        self.key = (prefix, unit)
+
+    def observe(self, value: int | float):
+        run = CURRENT.get()
+        if run is None:
+            return
+
+        stats = run.gauges.get(self.key)
+        if stats is None:
+            run.gauges[self.key] = [value, value, value, 1]
+            return
+
+        stats[0] += value
+        if value < stats[1]:
+            stats[1] = value
+        if value > stats[2]:
+            stats[2] = value
+        stats[3] += 1
+
+
+class Histogram:
+    """How often each value was observed in the current run"""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+
+    def observe(self, value: int):
+        run = CURRENT.get()
+        if run is None:
+            return
+
+        counts = run.histograms.get(self.key)
+        if counts is None:
+            counts = run.histograms[self.key] = {}
+        counts[value] = counts.get(value, 0) + 1
+
+
+class Timer:
+    """
+    Total time between start and stop in the current run, with a log2 histogram of
+    the durations
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+
+    def start(self) -> int:
+        if CURRENT.get() is None:
+            return 0
+        return time.perf_counter_ns()
+
+    def stop(self, start: int):
+        run = CURRENT.get()
+        if run is None or start == 0:
+            return
+
+        elapsed = time.perf_counter_ns() - start
+        stats = run.timers.get(self.key)
+        if stats is None:
+            stats = run.timers[self.key] = [0, 0, {}]
+        stats[0] += elapsed
+        stats[1] += 1
+        bucket = elapsed.bit_length()
+        stats[2][bucket] = stats[2].get(bucket, 0) + 1
+
+
+# The run being recorded in the current context. New threads start without
+# one, forked worker processes reset it in their initializer.
+CURRENT: ContextVar[Run | None] = ContextVar("benchmark_run", default=None)
+
+# Exported data of the finished runs, by id
 BENCH_INFO = {}
-CUR_BENCH = None
 
 
-def start_benchmark(id: str):
-    global CUR_BENCH
-    CUR_BENCH = id
-    BENCH_INFO[CUR_BENCH] = {"start": time.time_ns()}
+class JsonlSink:
+    """Appends every finished run to a file as one JSON line"""
+
+    path: Path
+    fsync: bool
+
+    def __init__(self, path: Path | str, fsync: bool = False) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self._file = open(self.path, "a")
+
+        # Start on a line of its own after a line cut off by a crash
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read() != b"\n":
+                    self._file.write("\n")
+
+    def write(self, id: str, data: dict):
+        line = json.dumps({"id": id, "data": data}, cls=NpEncoder)
+        self._file.write(line + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# Where end_benchmark streams finished runs, opened on first use
+SINK: JsonlSink | None = None
+
+
+def stream_to(path: Path | str, fsync: bool = False) -> JsonlSink:
+    """Stream the runs finished from now on to path, instead of the default file"""
+    global SINK
+    if SINK is not None:
+        SINK.close()
+    SINK = JsonlSink(path, fsync)
+    return SINK
+
+
+def load_benchmarks(path: Path | str) -> dict:
+    """
+    The runs by id in a .jsonl file of JsonlSink, skipping lines cut off by a crash,
+    or in a .json file of write_benchmark
+    """
+    path = Path(path)
+    with open(path) as f:
+        if path.suffix == ".json":
+            return json.load(f)
+        lines = f.read().splitlines()
+
+    benches = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        benches[record["id"]] = record["data"]
+    return benches
+
+
+def current() -> Run | None:
+    return CURRENT.get()
+
+
+def start_benchmark(id: str) -> Run:
+    run = Run(id)
+    CURRENT.set(run)
+    return run
+
+
+@contextmanager
+def recording(id: str):
+    """Record a run for the duration of the block, without keeping it in BENCH_INFO"""
+    run = Run(id)
+    token = CURRENT.set(run)
+    try:
+        yield run
+    finally:
+        CURRENT.reset(token)
 
 
 def register(key: str, value):
-    if CUR_BENCH is None:
+    run = CURRENT.get()
+    if run is None:
+        return
+
+    run.info[key] = value
+
+
+def append(key: str, value):
+    """Add value to the series key of the current run"""
+    run = CURRENT.get()
+    if run is None:
         return
 
-    BENCH_INFO[CUR_BENCH][key] = value
+    run.series.setdefault(key, []).append(value)
 
 
 def get_or_default(key: str, default):
-    if CUR_BENCH is None:
+    run = CURRENT.get()
+    if run is None:
         return None
 
-    if key in BENCH_INFO[CUR_BENCH]:
-        return BENCH_INFO[CUR_BENCH][key]
-    else:
-        return default
+    return run.info.get(key, default)
 
 
 def register_or_update(key: str, default, updater):
-    if CUR_BENCH is None:
+    run = CURRENT.get()
+    if run is None:
         return
 
-    if key in BENCH_INFO[CUR_BENCH]:
-        BENCH_INFO[CUR_BENCH][key] = updater(BENCH_INFO[CUR_BENCH][key])
+    if key in run.info:
+        run.info[key] = updater(run.info[key])
     else:
-        BENCH_INFO[CUR_BENCH][key] = default
+        run.info[key] = default
+
+
+def merge(other: Run):
+    """Fold a run recorded elsewhere, e.g. in a worker process, into the current one"""
+    run = CURRENT.get()
+    if run is None:
+        return
+
+    run.merge(other)
 
 
 def end_benchmark():
-    global CUR_BENCH
-    BENCH_INFO[CUR_BENCH]["end"] = time.time_ns()
-    BENCH_INFO[CUR_BENCH]["duration_s"] = (
-        BENCH_INFO[CUR_BENCH]["end"] - BENCH_INFO[CUR_BENCH]["start"]
-    ) / 1e9
-    CUR_BENCH = None
+    run = CURRENT.get()
+    run.info["end"] = time.time_ns()
+    run.info["duration_s"] = (run.info["end"] - run.info["start"]) / 1e9
+    BENCH_INFO[run.id] = run.export()
+    CURRENT.set(None)
 
     # so we have the data if we kill the program or it crashes
-    write_benchmark(f"benchmark-tmp.json")
+    if SINK is None:
+        stream_to(Path("benches") / f"benchmark-{int(time.time())}.jsonl")
+    SINK.write(run.id, BENCH_INFO[run.id])
 
 
 def write_benchmark(filename: str | None = None):
@@ -64,9 +335,9 @@ def write_benchmark(filename: str | None = None):
 
 
 def clear():
-    global BENCH_INFO,CUR_BENCH
+    global BENCH_INFO
     BENCH_INFO = {}
-    CUR_BENCH = None
+    CURRENT.set(None)
 
 
 class NpEncoder(json.JSONEncoder):
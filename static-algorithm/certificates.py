@@ -0,0 +1,96 @@
+import math
+from typing import Tuple
+import numpy as np
+from min_cost_flow_instance import MinCostFlow
+
+# Number of IPM iterations between two certificate checks
+CHECK_INTERVAL = 50
+
+# Verdicts of a probe that was settled before the IPM converged
+GUESS_TOO_HIGH = "too_high"
+GUESS_FEASIBLE = "feasible"
+
+# Residual capacity up to which an edge counts as saturated when looking for
+# a small s-t cut. Any s-t cut bounds the max flow, so this only affects how
+# good the bound is, not whether it holds.
+SATURATION = 0.5
+
+# Slack for floating point error when rounding a fractional bound to the
+# integral max flow
+INTEGRALITY_TOLERANCE = 1e-6
+
+
+class ProbeCertificate:
+    """Bounds on the max flow from a feasible flow, which settle a probe before the IPM converges"""
+
+    I: MinCostFlow
+    flow_idx: int
+    s: int
+    t: int
+    aux_out: np.ndarray  # Auxiliary edges leaving v*.
+    no_lower_bounds: bool
+
+    def __init__(self, I: MinCostFlow, original_m: int) -> None:
+        self.I = I
+        self.flow_idx = original_m - 1
+        self.t = int(I.tail[self.flow_idx])
+        self.s = int(I.head[self.flow_idx])
+
+        # calc_feasible_flow adds v* last and its edges after the original ones
+        v_star = I.n - 1
+        self.aux_out = np.flatnonzero(I.tail[original_m:] == v_star) + original_m
+        self.no_lower_bounds = not np.any(I.u_lower[: self.flow_idx])
+
+    def check(self, flow: np.ndarray, guess: int) -> str | None:
+        """The verdict on the guess the current flow proves, if any"""
+        lower, upper = self.bounds(flow)
+        if upper < guess:
+            return GUESS_TOO_HIGH
+        if lower >= guess:
+            return GUESS_FEASIBLE
+        return None
+
+    def bounds(self, flow: np.ndarray) -> Tuple[int, float]:
+        """Lower and upper bound on the integral max flow proven by flow"""
+        lower = 0
+        # Dropping the cycles through v* could violate nonzero lower capacities
+        if self.no_lower_bounds:
+            value = self.flow_value(flow) - INTEGRALITY_TOLERANCE
+            lower = max(lower, math.ceil(value))
+
+        upper = np.floor(self.cut_bound(flow) + INTEGRALITY_TOLERANCE)
+        return lower, float(upper)
+
+    def cut_bound(self, flow: np.ndarray) -> float:
+        """Capacity of the s-t cut found from the residual graph of flow"""
+        I, k = self.I, self.flow_idx
+        tail, head = I.tail[:k], I.head[:k]
+
+        # Unsaturated edges of the max flow instance, without t -> s and the auxiliary ones
+        forward = np.zeros(I.m, dtype=bool)
+        backward = np.zeros(I.m, dtype=bool)
+        forward[:k] = I.u_upper[:k] - flow[:k] > SATURATION
+        backward[:k] = flow[:k] - I.u_lower[:k] > SATURATION
+
+        def unsaturated(edges: np.ndarray, v: np.ndarray) -> np.ndarray:
+            return np.where(I.tail[edges] == v, forward[edges], backward[edges])
+
+        reached = np.zeros(I.n, dtype=bool)
+        I.bfs_layers(np.array([self.s]), reached, unsaturated)
+
+        if reached[self.t]:
+            return np.inf
+
+        leaving = reached[tail] & ~reached[head]
+        entering = reached[head] & ~reached[tail]
+        return float(np.sum(I.u_upper[:k][leaving]) - np.sum(I.u_lower[:k][entering]))
+
+    def original_cut_bound(self, flows: np.ndarray) -> float:
+        """cut_bound of a flow given on the original edges only"""
+        padded = np.zeros(self.I.m)
+        padded[: len(flows)] = flows
+        return self.cut_bound(padded)
+
+    def flow_value(self, flow: np.ndarray) -> float:
+        """Value of a flow on the original edges contained in flow"""
+        return float(flow[self.flow_idx] - np.sum(flow[self.aux_out]))
@@ -0,0 +1,300 @@
+from collections import deque
+from typing import Tuple
+import numpy as np
+import benchmark
+from min_cost_flow_instance import MinCostFlow
+from utils import log
+
+# The IPM stops within ROUNDING_GAP of the optimal cost, which leaves about
+# a unit of flow value for the cleanup to augment. It may use a few more
+# paths to move the excess that rounding leaves at single vertices.
+REPAIR_AUGMENTATIONS = 4
+
+# Distance to the nearest integer up to which a flow counts as integral
+INTEGRALITY_TOLERANCE = 1e-6
+
+CLEANUP_AUGMENTATIONS = benchmark.Counter("cleanup_augmentations")
+CLEANUP_TIME = benchmark.Timer("cleanup")
+
+
+class ResidualGraph:
+    """Residual graph of an integral flow on the original edges of a max flow instance"""
+
+    tail: list[int]
+    head: list[int]
+    lower: list[int]
+    upper: list[int]
+    flow: list[int]
+    adj: list[list[int]]
+    augmentations: int
+
+    def __init__(
+        self,
+        tail: np.ndarray,
+        head: np.ndarray,
+        lower: np.ndarray,
+        upper: np.ndarray,
+        flow: np.ndarray,
+        n: int,
+    ):
+        self.tail = tail.tolist()
+        self.head = head.tolist()
+        self.lower = [int(x) for x in np.ceil(lower)]
+        self.upper = [int(x) for x in np.floor(upper)]
+        self.flow = [
+            min(max(int(x), lo), hi)
+            for x, lo, hi in zip(np.round(flow), self.lower, self.upper)
+        ]
+        self.augmentations = 0
+
+        self.adj = [[] for _ in range(n)]
+        for e, (a, b) in enumerate(zip(self.tail, self.head)):
+            self.adj[a].append(e)
+            self.adj[b].append(e)
+
+    def excess(self) -> list[int]:
+        """Inflow minus outflow of every vertex"""
+        excess = [0] * len(self.adj)
+        for e, f in enumerate(self.flow):
+            excess[self.tail[e]] -= f
+            excess[self.head[e]] += f
+        return excess
+
+    def route(
+        self,
+        supply: dict[int, float],
+        demand: dict[int, float],
+        limit: int | None = None,
+    ):
+        """Send supply to demand along shortest residual paths, at most limit of them, in place"""
+        start = self.augmentations
+        while supply and demand:
+            if limit is not None and self.augmentations - start >= limit:
+                return
+
+            path = self._shortest_path(supply, demand)
+            if path is None:
+                return
+
+            source, sink, arcs = path
+            amount = min(supply[source], demand[sink])
+            for e, forward in arcs:
+                residual = (
+                    self.upper[e] - self.flow[e]
+                    if forward
+                    else self.flow[e] - self.lower[e]
+                )
+                amount = min(amount, residual)
+
+            for e, forward in arcs:
+                self.flow[e] += amount if forward else -amount
+            self.augmentations += 1
+
+            supply[source] -= amount
+            demand[sink] -= amount
+            if supply[source] == 0:
+                del supply[source]
+            if demand[sink] == 0:
+                del demand[sink]
+
+    def cancel_through(self, s: int, t: int):
+        """Cancel the flow paths and cycles entering s or leaving t, which keeps the flow value"""
+        for root, into in [(s, True), (t, False)]:
+            while (walk := self._flow_walk(root, into, s, t)) is not None:
+                amount = min(self.flow[e] - self.lower[e] for e in walk)
+                for e in walk:
+                    self.flow[e] -= amount
+
+    def _flow_walk(self, root: int, into: bool, s: int, t: int) -> list[int] | None:
+        """Flow-carrying edges followed into or out of root, up to a cycle or the other of s and t"""
+        start, end = (self.head, self.tail) if into else (self.tail, self.head)
+        walk: list[int] = []
+        position = {root: 0}
+        v = root
+        while True:
+            e = next(
+                (
+                    e
+                    for e in self.adj[v]
+                    if start[e] == v and self.flow[e] > self.lower[e]
+                ),
+                None,
+            )
+            if e is None:
+                return None  # Only at root, or where lower bounds hold flow
+
+            walk.append(e)
+            v = end[e]
+            if v in position:
+                return walk[position[v] :]
+            if v in (s, t):
+                return walk
+            position[v] = len(walk)
+
+    def _shortest_path(
+        self, supply: dict[int, float], demand: dict[int, float]
+    ) -> Tuple[int, int, list[Tuple[int, bool]]] | None:
+        """BFS from all vertices with supply to the closest one with demand"""
+        parent: dict[int, Tuple[int, bool] | None] = {v: None for v in supply}
+        queue = deque(supply)
+        while queue:
+            v = queue.popleft()
+            if v in demand and parent[v] is not None:
+                arcs = []
+                u = v
+                while parent[u] is not None:
+                    e, forward = parent[u]
+                    arcs.append((e, forward))
+                    u = self.tail[e] if forward else self.head[e]
+                return u, v, arcs[::-1]
+
+            for e in self.adj[v]:
+                if self.tail[e] == v and self.flow[e] < self.upper[e]:
+                    w, arc = self.head[e], (e, True)
+                elif self.head[e] == v and self.flow[e] > self.lower[e]:
+                    w, arc = self.tail[e], (e, False)
+                else:
+                    continue
+
+                if w not in parent:
+                    parent[w] = arc
+                    queue.append(w)
+
+        return None
+
+
+def round_circulation(
+    tail: list[int], head: list[int], flow: np.ndarray, n: int, raise_edge: int
+) -> np.ndarray:
+    """Round a flow around cycles of fractional edges, never against raise_edge, keeping excesses"""
+    flow = flow.astype(float)
+    integral = np.abs(flow - np.round(flow)) <= INTEGRALITY_TOLERANCE
+    flow[integral] = np.round(flow[integral])
+    fractional = set(np.flatnonzero(~integral).tolist())
+    adj: list[set[int]] = [set() for _ in range(n)]
+    for e in fractional:
+        adj[tail[e]].add(e)
+        adj[head[e]].add(e)
+
+    def settle(e: int):
+        flow[e] = np.round(flow[e])
+        fractional.discard(e)
+        adj[tail[e]].discard(e)
+        adj[head[e]].discard(e)
+
+    while fractional:
+        v = tail[next(iter(fractional))]
+        walk: list[Tuple[int, bool, int]] = []  # Edge, forward, vertex it leaves
+        position = {v: 0}
+        while True:
+            arrived = walk[-1][0] if walk else None
+            e = next((e for e in adj[v] if e != arrived), None)
+            # A dead end has fractional excess, which rounding the edge into it fixes
+            if e is None:
+                if arrived is None:
+                    break
+                settle(arrived)
+                del position[v]
+                v = walk.pop()[2]
+                continue
+
+            forward = tail[e] == v
+            walk.append((e, forward, v))
+            v = head[e] if forward else tail[e]
+            if v not in position:
+                position[v] = len(walk)
+                continue
+
+            cycle = walk[position[v] :]
+            sign = 1.0
+            if any(e == raise_edge and not forward for e, forward, _ in cycle):
+                sign = -1.0
+            changes = [sign if forward else -sign for _, forward, _ in cycle]
+            room = [
+                np.ceil(flow[e]) - flow[e]
+                if change > 0
+                else flow[e] - np.floor(flow[e])
+                for (e, _, _), change in zip(cycle, changes)
+            ]
+            amount = min(room)
+            for (e, _, _), change, left in zip(cycle, changes, room):
+                flow[e] += change * amount
+                if left == amount:
+                    settle(e)
+
+            for _, _, u in cycle[1:]:
+                del position[u]
+            del walk[position[v] :]
+
+    return flow
+
+
+def repair_flow(
+    I: MinCostFlow,
+    flow: np.ndarray,
+    original_m: int,
+    augmentations: int = REPAIR_AUGMENTATIONS,
+    require_max: bool = True,
+) -> Tuple[int, np.ndarray] | None:
+    """Round the flow and repair it with augmentations paths, raising if require_max and it is not maximal"""
+    start = CLEANUP_TIME.start()
+    try:
+        return _repair_flow(I, flow, original_m, augmentations, require_max)
+    finally:
+        CLEANUP_TIME.stop(start)
+
+
+def _repair_flow(
+    I: MinCostFlow,
+    flow: np.ndarray,
+    original_m: int,
+    augmentations: int,
+    require_max: bool,
+) -> Tuple[int, np.ndarray] | None:
+    flow_idx = original_m - 1
+    t, s = int(I.tail[flow_idx]), int(I.head[flow_idx])
+    tail, head, flow = I.tail[:flow_idx], I.head[:flow_idx], flow[:flow_idx]
+
+    # A t -> s edge carrying the flow's value closes it into a circulation
+    value = np.sum(flow[head == t]) - np.sum(flow[tail == t])
+    rounded = round_circulation(
+        tail.tolist() + [t],
+        head.tolist() + [s],
+        np.append(flow, value),
+        I.n,
+        raise_edge=flow_idx,
+    )
+    graph = ResidualGraph(
+        tail, head, I.u_lower[:flow_idx], I.u_upper[:flow_idx], rounded[:-1], I.n
+    )
+
+    excess = graph.excess()
+    surplus = {v: x for v, x in enumerate(excess) if x > 0 and v not in (s, t)}
+    lacking = {v: -x for v, x in enumerate(excess) if x < 0 and v not in (s, t)}
+    log("Cleanup: surplus", surplus, "lacking", lacking)
+
+    # Balance vertices among each other, what is left through s or t, raising
+    # the flow value where possible, and finally augment
+    for supply, demand in [
+        (surplus, lacking),
+        (surplus, {t: np.inf}),
+        ({s: np.inf}, lacking),
+        (surplus, {s: np.inf}),
+        ({t: np.inf}, lacking),
+        ({s: np.inf}, {t: np.inf}),
+    ]:
+        graph.route(supply, demand, limit=augmentations - graph.augmentations)
+    CLEANUP_AUGMENTATIONS.add(graph.augmentations)
+    # None if conservation could not be restored
+    if surplus or lacking:
+        log("Cleanup could not restore flow conservation")
+        return None
+    if require_max and graph._shortest_path({s: np.inf}, {t: np.inf}):
+        raise RuntimeError(
+            f"Rounding the flow left more than {augmentations} augmenting paths "
+            "to repair, so the IPM stopped too far from the max flow"
+        )
+    graph.cancel_through(s, t)
+
+    value = graph.excess()[t]
+    return value, np.array(graph.flow, dtype=float)
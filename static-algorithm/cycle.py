@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+import numpy as np
+from numpy.typing import NDArray
+
+
+@dataclass
+class Cycle:
+    """
+    A cycle stored sparsely as the edges it uses and the direction (+1 along
+    the edge, -1 against it) it uses each of them in.
+    """
+
+    edges: NDArray[np.int64]
+    directions: NDArray[np.float64]
+
+    @staticmethod
+    def empty() -> "Cycle":
+        return Cycle(
+            edges=np.zeros(0, dtype=np.int64),
+            directions=np.zeros(0, dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.edges)
+
+    def dot(self, x: NDArray[np.float64]) -> float:
+        """Inner product of the cycle's edge vector with x"""
+        return float(np.dot(x[self.edges], self.directions))
+
+    def abs_dot(self, x: NDArray[np.float64]) -> float:
+        """Inner product of the cycle's absolute edge vector with x"""
+        return float(np.sum(x[self.edges]))
+
+    def augment(self, flow: NDArray[np.float64], amount: float):
+        """Route amount units of flow around the cycle, in place"""
+        flow[self.edges] += amount * self.directions
+
+    def to_dense(self, m: int) -> NDArray[np.float64]:
+        edge_cycle = np.zeros(m, dtype=np.float64)
+        edge_cycle[self.edges] = self.directions
+        return edge_cycle
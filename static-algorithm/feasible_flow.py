@@ -1,11 +1,26 @@
-from copy import deepcopy
 import numpy as np
+from cleanup import ResidualGraph
 from min_cost_flow_instance import MinCostFlow
 
+# Number of augmenting paths combinatorial_flow routes, and the share of the
+# capacity midpoint it mixes in to move the flow strictly inside the bounds
+INITIAL_AUGMENTATIONS = 20
+INTERIOR_SHRINK = 0.01
 
-def calc_feasible_flow(I_or: MinCostFlow):
-    # TODO: Probably thanos-snap this
-    I = deepcopy(I_or)
+# Excess up to which a vertex counts as balanced. Mixing flows leaves
+# floating point noise, and an auxiliary edge for it would start out right
+# next to its bounds.
+BALANCE_TOLERANCE = 1e-9
+
+
+def calc_feasible_flow(I_or: MinCostFlow, init_flow: np.ndarray | None = None):
+    """
+    Extend I_or by a vertex v* and auxiliary edges through it so that
+    init_flow, which must be strictly inside the bounds, becomes feasible.
+    Without init_flow, the capacity midpoint is used.
+    """
+    # Grow an overlay, so I_or is left as it was and can be reused
+    I = I_or.overlay()
 
     # Add a new vertex v*
     v_star = I.add_vertex()
@@ -14,21 +29,61 @@ def calc_feasible_flow(I_or: MinCostFlow):
     demands = np.zeros(I.n, dtype=int)
     assert np.sum(demands) == 0
 
-    init_flow = (I.u_lower + I.u_upper) / 2
-    d_hat = np.dot(I.B.transpose(), init_flow)
+    if init_flow is None:
+        init_flow = (I.u_lower + I.u_upper) / 2
+    d_hat = I.BT_dot(init_flow)
+
+    # As a float, since U**2 overflows int64 for capacities beyond about 2^31
+    c = 4 * I.m * float(I.U) ** 2
 
-    c = 4 * I.m * I.U ** 2
-    for v in range(I.n):
-        dh = d_hat[v]
-        d = demands[v]
+    # Route each vertex's excess through v*: excess leaves v* towards the
+    # vertex, deficit goes from the vertex to v*
+    excess = d_hat - demands
+    vertices = np.flatnonzero(np.abs(excess) > BALANCE_TOLERANCE)
+    surplus = excess[vertices] > 0
+    amounts = np.abs(excess[vertices])
 
-        if dh > d:
-            I.add_edge(v_star, v, c, 0, 2 * (dh - d))
-            init_flow = np.append(init_flow, dh - d)
-        elif dh < d:
-            I.add_edge(v, v_star, c, 0, 2 * (d - dh))
-            init_flow = np.append(init_flow, d - dh)
+    I.add_edges(
+        tails=np.where(surplus, v_star, vertices),
+        heads=np.where(surplus, vertices, v_star),
+        c=np.full(len(vertices), c),
+        u_lower=np.zeros(len(vertices), dtype=int),
+        u_upper=2 * amounts,
+    )
+    init_flow = np.concatenate((init_flow, amounts))
 
     assert len(init_flow) == I.m
 
     return I, init_flow
+
+
+def combinatorial_flow(
+    I: MinCostFlow,
+    target: float,
+    augmentations: int = INITIAL_AUGMENTATIONS,
+    shrink: float = INTERIOR_SHRINK,
+) -> np.ndarray:
+    """
+    A starting point for calc_feasible_flow on an instance from
+    MinCostFlow.from_max_flow_instance: the flow of up to target units along
+    at most augmentations shortest augmenting paths, moved shrink of the way
+    to the capacity midpoint so that it is strictly inside the bounds. Only
+    the midpoint's share needs auxiliary edges to balance it, so they start
+    out carrying less of their expensive flow.
+    """
+    flow_idx = I.m - 1
+    t, s = int(I.tail[flow_idx]), int(I.head[flow_idx])
+    graph = ResidualGraph(
+        I.tail[:flow_idx],
+        I.head[:flow_idx],
+        I.u_lower[:flow_idx],
+        I.u_upper[:flow_idx],
+        np.zeros(flow_idx),
+        I.n,
+    )
+    graph.route({s: target}, {t: np.inf}, limit=augmentations)
+
+    # The t -> s edge closes the paths into a circulation
+    flow = np.array(graph.flow + [graph.excess()[t]], dtype=float)
+    midpoint = (I.u_lower + I.u_upper) / 2
+    return (1 - shrink) * flow + shrink * midpoint
@@ -5,6 +5,8 @@ import utils
 
 # all credit to Riko Jacob for this code
 
+EDGE_UPDATES = benchmark.Gauge("capacity", "updates")
+
 
 def find_max_flow(
     edges: list[Edge], capacities: list[int], s: int, t: int
@@ -72,12 +74,6 @@ def flow(
                 mincap = mincap // 2
                 continue
             else:
-                total_updates = benchmark.get_or_default("capacity_total_updates", 0)
-                total_iters = benchmark.get_or_default("capacity_total_iterations", 1)
-                if total_iters != None:
-                    benchmark.register(
-                        "capacity_avg_updates", total_updates / total_iters
-                    )
                 return (
                     current_flow,
                     {
@@ -95,17 +91,4 @@ def flow(
             graph[u][v] -= saturation
             graph[v][u] += saturation
 
-        benchmark.register_or_update(
-            "capacity_total_updates", edge_updates, lambda x: x + edge_updates
-        )
-        benchmark.register_or_update(
-            "capacity_max_updates",
-            edge_updates,
-            lambda x: edge_updates if edge_updates > x else x,
-        )
-        benchmark.register_or_update(
-            "capacity_min_updates",
-            edge_updates,
-            lambda x: edge_updates if edge_updates < x else x,
-        )
-        benchmark.register_or_update("capacity_total_iterations", 1, lambda x: x + 1)
+        EDGE_UPDATES.observe(edge_updates)
@@ -4,6 +4,8 @@ from collections import defaultdict, deque
 import benchmark
 from tests.utils import Edge
 
+EDGE_UPDATES = benchmark.Gauge("edmond", "updates")
+
 
 class MaxFlow:
     n: int
@@ -66,25 +68,7 @@ class MaxFlow:
 
                 edge_updates += 2
 
-            benchmark.register_or_update(
-                "edmond_total_updates", edge_updates, lambda x: x + edge_updates
-            )
-            benchmark.register_or_update(
-                "edmond_max_updates",
-                edge_updates,
-                lambda x: edge_updates if edge_updates > x else x,
-            )
-            benchmark.register_or_update(
-                "edmond_min_updates",
-                edge_updates,
-                lambda x: edge_updates if edge_updates < x else x,
-            )
-            benchmark.register_or_update("edmond_total_iterations", 1, lambda x: x + 1)
-
-        total_updates = benchmark.get_or_default("edmond_total_updates", 0)
-        total_iters = benchmark.get_or_default("edmond_total_iterations", 1)
-        if total_iters != None:
-            benchmark.register("edmond_avg_updates", total_updates / total_iters)
+            EDGE_UPDATES.observe(edge_updates)
 
         return flow
 
@@ -3,6 +3,8 @@ from collections import defaultdict
 import benchmark
 from tests.utils import Edge
 
+EDGE_UPDATES = benchmark.Gauge("push_relabel", "updates")
+
 
 INF = 1000000000
 
@@ -38,23 +40,7 @@ class PushRelabel:
 
     def new_iteration(self):
         """Reset edge update counter."""
-        edge_updates = self.edge_updates
-        benchmark.register_or_update(
-            "push_relabel_total_updates", edge_updates, lambda x: x + edge_updates
-        )
-        benchmark.register_or_update(
-            "push_relabel_max_updates",
-            edge_updates,
-            lambda x: edge_updates if edge_updates > x else x,
-        )
-        benchmark.register_or_update(
-            "push_relabel_min_updates",
-            edge_updates,
-            lambda x: edge_updates if edge_updates < x else x,
-        )
-        benchmark.register_or_update(
-            "push_relabel_total_iterations", 1, lambda x: x + 1
-        )
+        EDGE_UPDATES.observe(self.edge_updates)
         self.edge_updates = 0
 
     def add_edge(self, u: int, v: int, cap: int) -> None:
@@ -131,10 +117,6 @@ class PushRelabel:
                     self.relabel(i)
                     break
 
-        total_updates = benchmark.get_or_default("push_relabel_total_updates", 0)
-        total_iters = benchmark.get_or_default("push_relabel_total_iterations", 1)
-        if total_iters != None:
-            benchmark.register("push_relabel_avg_updates", total_updates / total_iters)
         benchmark.register("push_relabel_flow", self.excess[t])
 
         return self.excess[t]
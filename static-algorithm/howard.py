@@ -1,10 +1,31 @@
 import numpy as np
 from numpy.typing import NDArray
 
+import benchmark
+from cycle import Cycle
 from min_cost_flow_instance import MinCostFlow
+from utils import log
 
 INF = float("inf")
-EPS = -0.005
+TOLERANCE = 1e-12
+MAX_ITERATIONS = 1000
+
+# Per call: the policy iterations, whether they ran out at MAX_ITERATIONS
+# before the policy converged, and the length of the cycle found. Per
+# policy iteration: how many vertices switched to a better arc.
+SWEEPS = benchmark.Gauge("howard", "sweeps")
+CAP_HITS = benchmark.Counter("howard_cap_hits")
+CYCLE_LENGTHS = benchmark.Histogram("howard_cycle_length")
+SWITCHES = benchmark.Gauge("howard_sweep", "switches")
+
+
+def record_call(sweeps: int, converged: bool, cycle: Cycle):
+    """Record a call to find_optimum_cycle_ratio in the current benchmark"""
+    SWEEPS.observe(sweeps)
+    CYCLE_LENGTHS.observe(len(cycle))
+    if not converged:
+        log("Howard did not converge within", MAX_ITERATIONS, "policy iterations")
+        CAP_HITS.add()
 
 
 class Howard:
@@ -15,7 +36,7 @@ class Howard:
     distances: list[float]
     policy: list[int]
     bad_vertices: list[bool]  # Vertices with no outgoing edges.
-    in_edges_list: list[list[int]]
+    in_edges_list: list[set[int]]
 
     sink: int
     bound: float
@@ -23,6 +44,12 @@ class Howard:
 
     critical_cycle: list[int] | None
     critical_vertex: int | None
+    sweeps: int
+    converged: bool  # Whether the last call ended before MAX_ITERATIONS.
+
+    tails: list[int]
+    heads: list[int]
+    adj: list[list[int]]
 
     gradients: NDArray[np.float64]
     lengths: NDArray[np.float64]
@@ -36,6 +63,12 @@ class Howard:
         self.g = graph
 
         self.V = graph.n
+        # Plain lists are much faster than numpy scalars in the loops below
+        self.tails = graph.tail.tolist()
+        self.heads = graph.head.tolist()
+        offsets, edge_ids = graph.incidence()
+        edge_ids = edge_ids.tolist()
+        self.adj = [edge_ids[offsets[v] : offsets[v + 1]] for v in range(self.V)]
         self.distances = [0.0] * self.V
         self.policy = [-1] * self.V  # Current edge choice for each vertex
         self.bad_vertices = [False] * self.V
@@ -43,8 +76,8 @@ class Howard:
         self.gradients = gradients
         self.lengths = lengths
 
-        # In-edges lists for policy graph
-        self.in_edges_list = [[] for _ in range(self.V)]
+        # In-edges of the policy graph, i.e. the vertices whose policy points here
+        self.in_edges_list = [set() for _ in range(self.V)]
 
         self.sink = -1  # Special vertex for handling vertices with no outgoing edges
         self.bound = self._compute_bound()
@@ -52,6 +85,8 @@ class Howard:
 
         self.critical_cycle = None
         self.critical_vertex = None
+        self.sweeps = 0
+        self.converged = True
 
     def _compute_bound(self) -> float:
         """Compute bound for cycle ratio"""
@@ -68,19 +103,17 @@ class Howard:
 
     def _get_gradient(self, start: int, edge_id: int) -> float:
         """Get gradient for given edge"""
-        edge = self.g.edges[edge_id]
-        if edge[0] == start:
+        if self.tails[edge_id] == start:
             return -self.gradients[edge_id]
         else:
             return self.gradients[edge_id]
 
     def _get_edge_target(self, start: int, edge_id: int) -> int:
         """Get target vertex for given edge"""
-        edge = self.g.edges[edge_id]
-        if edge[0] == start:
-            return edge[1]
+        if self.tails[edge_id] == start:
+            return self.heads[edge_id]
         else:
-            return edge[0]
+            return self.tails[edge_id]
 
     def _construct_policy_graph(self):
         """Construct initial policy graph"""
@@ -88,7 +121,7 @@ class Howard:
             best_edge = -1
             best_weight: float = -INF
 
-            for edge_id in self.g.adj[v]:
+            for edge_id in self.adj[v]:
                 gradient = self._get_gradient(v, edge_id)
                 if gradient > best_weight:
                     best_weight = gradient
@@ -98,25 +131,41 @@ class Howard:
                 if self.sink == -1:
                     self.sink = v
                 self.bad_vertices[v] = True
-                self.in_edges_list[self.sink].append(v)
+                self.in_edges_list[self.sink].add(v)
             else:
                 target = self._get_edge_target(v, best_edge)
-                self.in_edges_list[target].append(v)
+                self.in_edges_list[target].add(v)
                 self.policy[v] = best_edge
 
-    def _find_cycle_vertex(self, start: int) -> int:
-        """Find vertex that belongs to a cycle in policy graph"""
-        current: int = start
-        visited: set[int] = set()
+    def _policy_target(self, v: int) -> int:
+        """Successor of v in the policy graph"""
+        if self.bad_vertices[v]:
+            return self.sink
+        return self._get_edge_target(v, self.policy[v])
 
-        while current not in visited:
-            visited.add(current)
-            if not self.bad_vertices[current]:
-                current = self._get_edge_target(current, self.policy[current])
-            else:
-                current = self.sink
+    def _find_cycle_vertices(self) -> list[int]:
+        """
+        Find one vertex on each cycle of the policy graph. Every vertex is
+        colored with the start of the walk that first reached it, so each
+        vertex is visited once and a walk closes a new cycle exactly when it
+        runs into its own color.
+        """
+        visited = [-1] * self.V
+        cycle_vertices: list[int] = []
+
+        for v in range(self.V):
+            if visited[v] != -1:
+                continue
+
+            current = v
+            while visited[current] == -1:
+                visited[current] = v
+                current = self._policy_target(current)
 
-        return current
+            if visited[current] == v:
+                cycle_vertices.append(current)
+
+        return cycle_vertices
 
     def _compute_cycle_ratio(self, start: int) -> float:
         """Compute ratio of cycle starting at given vertex"""
@@ -145,90 +194,377 @@ class Howard:
 
         return ratio
 
-    def _improve_policy(self, current_ratio: float) -> bool:
-        """Try to improve current policy"""
-        improved = False
+    def _determine_values(self, current_ratio: float):
+        """
+        Recompute the distances of every vertex whose policy path leads to the
+        critical vertex, by a reverse traversal of the policy graph from it.
+        """
+        assert self.critical_vertex is not None
+
+        visited = {self.critical_vertex}
+        queue = [self.critical_vertex]
+        while queue:
+            v = queue.pop()
+            for u in self.in_edges_list[v]:
+                if u in visited:
+                    continue
+
+                visited.add(u)
+                edge_id = self.policy[u]
+                self.distances[u] = (
+                    self._get_gradient(u, edge_id)
+                    - current_ratio * self.lengths[edge_id]
+                    + self.distances[v]
+                )
+                queue.append(u)
+
+    def _improve_policy(self, current_ratio: float) -> int:
+        """Try to improve current policy, returns how many vertices switched arcs"""
+        switches = 0
 
         for v in range(self.V):
-            if not self.bad_vertices[v]:
-                for edge_id in self.g.adj[v]:
-                    target = self._get_edge_target(v, edge_id)
-                    new_dist: float = (
-                        self._get_gradient(v, edge_id)
-                        - current_ratio * self.lengths[edge_id]
-                        + self.distances[target]
-                    )
-
-                    if self.distances[v] + EPS > new_dist:
-                        # Update policy
-                        old_target = self._get_edge_target(v, self.policy[v])
-                        self.in_edges_list[old_target].remove(v)
-                        self.policy[v] = edge_id
-                        self.in_edges_list[target].append(v)
-                        self.distances[v] = new_dist
-                        improved = True
-            else:
-                new_dist = self.bound - current_ratio + self.distances[self.sink]
-                if self.distances[v] + EPS > new_dist:
+            if self.bad_vertices[v]:
+                continue
+
+            for edge_id in self.adj[v]:
+                target = self._get_edge_target(v, edge_id)
+                new_dist: float = (
+                    self._get_gradient(v, edge_id)
+                    - current_ratio * self.lengths[edge_id]
+                    + self.distances[target]
+                )
+
+                slack = TOLERANCE * max(1.0, abs(self.distances[v]))
+                if self.distances[v] - new_dist > slack:
+                    # Update policy
+                    old_target = self._get_edge_target(v, self.policy[v])
+                    self.in_edges_list[old_target].remove(v)
+                    self.policy[v] = edge_id
+                    self.in_edges_list[target].add(v)
                     self.distances[v] = new_dist
+                    switches += 1
 
-        return improved
+        SWITCHES.observe(switches)
+        return switches
 
-    def find_optimum_cycle_ratio(self) -> tuple[float, NDArray[np.float64]]:
+    def find_optimum_cycle_ratio(self) -> tuple[float, Cycle]:
         """
         Find optimum (minimum/maximum) cycle ratio.
         Returns (ratio, critical_cycle).
         """
         self._construct_policy_graph()
 
-        iteration = 0
-        ratio = INF
+        self.sweeps = 0
+        self.converged = False
+        while self.sweeps < MAX_ITERATIONS:  # Guard against floating point cycling
+            self.sweeps += 1
 
-        while iteration < 100:  # Limit iterations to avoid infinite loops
-            # Find current ratio
-            ratio = INF
+            # Find the best cycle of the current policy graph
+            previous_best = self.best_ratio
+            for cycle_vertex in self._find_cycle_vertices():
+                self._compute_cycle_ratio(cycle_vertex)
 
-            for v in range(self.V):
-                cycle_vertex = self._find_cycle_vertex(v)
-                curr_ratio = self._compute_cycle_ratio(cycle_vertex)
-                if ratio > curr_ratio:
-                    ratio = curr_ratio
+            # As in howard.c, only a better ratio changes the potentials, which
+            # are then recomputed for the tree hanging off the critical cycle
+            if self.best_ratio < previous_best:
+                self._determine_values(self.best_ratio)
 
             # Try to improve policy
-            if not self._improve_policy(ratio):
+            if not self._improve_policy(self.best_ratio):
+                self.converged = True
                 break
 
-            iteration += 1
-
-        if ratio > self.bound - 1e-10 or self.critical_cycle is None:
-            return INF, np.zeros(self.g.m, dtype=np.float64)
+        if self.best_ratio > self.bound - 1e-10 or self.critical_cycle is None:
+            ratio, cycle = INF, Cycle.empty()
         else:
-            return ratio, self._numpy_cycle()
+            ratio, cycle = self.best_ratio, self._sparse_cycle()
+        record_call(self.sweeps, self.converged, cycle)
+        return ratio, cycle
 
-    def _numpy_cycle(self) -> NDArray[np.float64]:
+    def _sparse_cycle(self) -> Cycle:
         """Convert cycle to edge representation"""
 
         if self.critical_cycle is None or self.critical_vertex is None:
-            return np.zeros(self.g.m, dtype=np.float64)
+            return Cycle.empty()
 
-        edge_cycle = np.zeros(self.g.m, dtype=np.float64)
+        directions: list[float] = []
         current = self.critical_vertex
 
         for edge_id in self.critical_cycle:
             target = self._get_edge_target(current, edge_id)
 
-            edge_cycle[edge_id] = 1.0 if current == self.g.edges[edge_id][0] else -1.0
+            directions.append(1.0 if current == self.tails[edge_id] else -1.0)
 
             current = target
 
-        return edge_cycle
+        return Cycle(
+            edges=np.array(self.critical_cycle, dtype=np.int64),
+            directions=np.array(directions, dtype=np.float64),
+        )
+
+
+class VectorizedHoward:
+    """
+    Howard's algorithm for computing minimum cycle ratio on flat arc arrays.
+
+    Every undirected edge e = (a, b) gives two arcs, a -> b with sign +1 and
+    b -> a with sign -1. Arcs are sorted by tail so that each vertex owns a
+    contiguous segment, which lets policy construction and improvement be done
+    with segment reductions instead of per-vertex Python loops.
+
+    The solver can be kept for a whole IPM run: after set_weights, the next
+    call to find_optimum_cycle_ratio restarts policy iteration from the
+    previous policy, with the distances of all its components recomputed for
+    the new weights, instead of from scratch.
+    """
+
+    n: int
+    m: int
+
+    arc_tail: NDArray[np.int64]
+    arc_head: NDArray[np.int64]
+    arc_edge: NDArray[np.int64]
+    arc_sign: NDArray[np.float64]
+    arc_weight: NDArray[np.float64]
+    arc_length: NDArray[np.float64]
+
+    active: NDArray[np.int64]  # Vertices with at least one outgoing arc.
+    seg_start: NDArray[np.int64]
+    seg_len: NDArray[np.int64]
+
+    policy: NDArray[np.int64]  # Arc chosen by each vertex, -1 if none.
+    distances: NDArray[np.float64]
+    has_policy: bool
+    sweeps: int  # Policy iterations done by the last call.
+    converged: bool  # Whether the last call ended before MAX_ITERATIONS.
+
+    bound: float
+    best_ratio: float
+    critical_vertex: int | None
+
+    def __init__(
+        self,
+        graph: MinCostFlow,
+        gradients: NDArray[np.float64],
+        lengths: NDArray[np.float64],
+    ):
+        self.n = graph.n
+        self.m = graph.m
+
+        # The incidence lists are sorted by vertex and then by edge id, which
+        # is the order the Python engine scans them in. Each one gives the arcs out of v.
+        offsets, self.arc_edge = graph.incidence()
+        counts = np.diff(offsets)
+        self.arc_tail = np.repeat(np.arange(self.n), counts)
+
+        tail = graph.tail[self.arc_edge]
+        head = graph.head[self.arc_edge]
+        forward = tail == self.arc_tail
+        self.arc_head = np.where(forward, head, tail)
+        self.arc_sign = np.where(forward, 1.0, -1.0)
+
+        self.active = np.flatnonzero(counts)
+        self.seg_start = offsets[self.active]
+        self.seg_len = counts[self.active]
+
+        self.policy = np.full(self.n, -1, dtype=np.int64)
+        self.distances = np.zeros(self.n, dtype=np.float64)
+        self.has_policy = False
+        self.sweeps = 0
+        self.converged = True
+
+        self.critical_vertex = None
+        self.set_weights(gradients, lengths)
+
+    def set_weights(self, gradients: NDArray[np.float64], lengths: NDArray[np.float64]):
+        """Set arc weights from edge gradients and lengths"""
+        self.arc_weight = -self.arc_sign * gradients[self.arc_edge]
+        self.arc_length = lengths[self.arc_edge]
+
+        abs_lengths = np.abs(lengths)
+        abs_lengths = abs_lengths[abs_lengths > 1e-10]
+        closest_to_zero = np.min(abs_lengths) if len(abs_lengths) > 0 else INF
+        self.bound = float(np.sum(np.abs(gradients)) / closest_to_zero)
+        self.best_ratio = self.bound
+        self.critical_vertex = None
+
+    def _segment_argmin(
+        self, values: NDArray[np.float64]
+    ) -> tuple[NDArray[np.float64], NDArray[np.int64]]:
+        """Minimum of each tail segment and the first arc attaining it"""
+        seg_min = np.minimum.reduceat(values, self.seg_start)
+        is_min = values == np.repeat(seg_min, self.seg_len)
+        candidates = np.where(is_min, np.arange(len(values)), len(values))
+        return seg_min, np.minimum.reduceat(candidates, self.seg_start)
+
+    def _construct_policy_graph(self):
+        """Construct initial policy graph"""
+        if len(self.active) == 0:
+            return
+        _, best_arcs = self._segment_argmin(-self.arc_weight)
+        self.policy[self.active] = best_arcs
+        self.has_policy = True
+
+    def _successors(self) -> NDArray[np.int64]:
+        """Successor of each vertex in the policy graph, itself if it has none"""
+        succ = np.arange(self.n)
+        succ[self.active] = self.arc_head[self.policy[self.active]]
+        return succ
+
+    def _find_cycles(
+        self, succ: NDArray[np.int64]
+    ) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+        """
+        Find the cycles of the policy graph by pointer doubling.
+        Returns (on_cycle, root) where on_cycle are the vertices lying on a
+        cycle, and root[v] is the smallest vertex of the cycle v reaches.
+        """
+        label = np.arange(self.n)
+        jump = succ.copy()
+        steps = 1
+        while steps < self.n:
+            label = np.minimum(label, label[jump])
+            jump = jump[jump]
+            steps *= 2
+
+        # After at least n steps every vertex has landed on its cycle, and
+        # every cycle vertex is reached from its predecessor on the cycle.
+        return np.unique(jump), label[jump]
+
+    def _determine_values(
+        self,
+        succ: NDArray[np.int64],
+        root: NDArray[np.int64],
+        ratio: float,
+        roots: NDArray[np.int64],
+    ):
+        """Recompute distances of vertices whose policy path ends in a cycle of roots"""
+        members = np.flatnonzero(np.isin(root, roots))
+
+        acc = np.zeros(self.n, dtype=np.float64)
+        arcs = self.policy[members]
+        acc[members] = self.arc_weight[arcs] - ratio * self.arc_length[arcs]
+
+        nxt = succ.copy()
+        nxt[roots] = roots
+        acc[roots] = 0.0
+
+        steps = 1
+        while steps < self.n:
+            acc = acc + acc[nxt]
+            nxt = nxt[nxt]
+            steps *= 2
+
+        self.distances[members] = self.distances[root[members]] + acc[members]
+
+    def _improve_policy(self, ratio: float) -> int:
+        """Try to improve current policy, returns how many vertices switched arcs"""
+        candidates = (
+            self.arc_weight - ratio * self.arc_length + self.distances[self.arc_head]
+        )
+        seg_min, seg_arg = self._segment_argmin(candidates)
+
+        current = self.distances[self.active]
+        improve = current - seg_min > TOLERANCE * np.maximum(1.0, np.abs(current))
+        switches = int(np.count_nonzero(improve))
+        SWITCHES.observe(switches)
+        if switches == 0:
+            return 0
+
+        vertices = self.active[improve]
+        self.distances[vertices] = seg_min[improve]
+        self.policy[vertices] = seg_arg[improve]
+        return switches
+
+    def find_optimum_cycle_ratio(self) -> tuple[float, Cycle]:
+        """
+        Find minimum cycle ratio.
+        Returns (ratio, critical_cycle).
+        """
+        if len(self.active) == 0:
+            self.sweeps, self.converged = 0, True
+            record_call(0, True, Cycle.empty())
+            return INF, Cycle.empty()
+
+        warm = self.has_policy
+        if not warm:
+            self._construct_policy_graph()
+
+        critical_cycle = None
+        is_good = np.zeros(self.n, dtype=bool)
+        is_good[self.active] = True
+
+        self.sweeps = 0
+        self.converged = False
+        while self.sweeps < MAX_ITERATIONS:
+            self.sweeps += 1
+
+            succ = self._successors()
+            on_cycle, root = self._find_cycles(succ)
+
+            on_cycle = on_cycle[is_good[on_cycle]]
+            cycle_arcs = self.policy[on_cycle]
+            sum_w1 = np.bincount(
+                root[on_cycle], weights=self.arc_weight[cycle_arcs], minlength=self.n
+            )
+            sum_w2 = np.bincount(
+                root[on_cycle], weights=self.arc_length[cycle_arcs], minlength=self.n
+            )
+
+            # A warm start's distances belong to the old weights, so its first
+            # sweep recomputes them for every component of the policy graph
+            refresh = warm and self.sweeps == 1
+            roots = np.unique(root[on_cycle])
+            ratios = sum_w1[roots] / sum_w2[roots]
+            best = int(np.argmin(ratios))
+            ratio = float(ratios[best])
+
+            if ratio < self.best_ratio:
+                self.best_ratio = ratio
+                self.critical_vertex = int(roots[best])
+                critical_cycle = self._cycle_arcs(self.critical_vertex, succ)
+                if not refresh:
+                    self._determine_values(succ, root, ratio, roots[best : best + 1])
+            if refresh:
+                self.distances[:] = 0.0
+                self._determine_values(succ, root, self.best_ratio, np.unique(root))
+
+            if not self._improve_policy(self.best_ratio):
+                self.converged = True
+                break
+
+        if self.best_ratio > self.bound - 1e-10 or critical_cycle is None:
+            ratio, cycle = INF, Cycle.empty()
+        else:
+            ratio, cycle = self.best_ratio, self._sparse_cycle(critical_cycle)
+        record_call(self.sweeps, self.converged, cycle)
+        return ratio, cycle
+
+    def _cycle_arcs(self, start: int, succ: NDArray[np.int64]) -> list[int]:
+        """Arcs of the policy cycle through start"""
+        arcs: list[int] = []
+        current = start
+        while True:
+            arcs.append(int(self.policy[current]))
+            current = int(succ[current])
+            if current == start:
+                break
+        return arcs
+
+    def _sparse_cycle(self, arcs: list[int]) -> Cycle:
+        """Convert cycle to edge representation"""
+        return Cycle(edges=self.arc_edge[arcs], directions=self.arc_sign[arcs])
 
 
 def minimum_cycle_ratio(
     g: MinCostFlow,
     gradients: NDArray[np.float64],
     lengths: NDArray[np.float64],
-) -> tuple[float, NDArray[np.float64]]:
+    vectorized: bool = False,
+) -> tuple[float, Cycle]:
     """Find minimum cycle ratio in graph"""
-    howard = Howard(g, gradients, lengths)
+    if vectorized:
+        howard = VectorizedHoward(g, gradients, lengths)
+    else:
+        howard = Howard(g, gradients, lengths)
     return howard.find_optimum_cycle_ratio()
@@ -1,14 +1,76 @@
-from typing import Tuple
-
-from numpy.typing import NDArray
-from howard import minimum_cycle_ratio
-from min_cost_flow_instance import MinCostFlow
-from feasible_flow import calc_feasible_flow
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Generator, Tuple
+
+from certificates import (
+    CHECK_INTERVAL,
+    GUESS_FEASIBLE,
+    GUESS_TOO_HIGH,
+    ProbeCertificate,
+)
+from cleanup import repair_flow
+from cycle import Cycle
+from howard import VectorizedHoward
+from min_cost_flow_instance import IncrementalPotential, MinCostFlow
+from feasible_flow import calc_feasible_flow, combinatorial_flow
 import numpy as np
 import benchmark
 from utils import log
 
 
+# The IPM runs until c·f - optimal_cost is below THRESHOLD, or below
+# ROUNDING_GAP when repair_flow rounds the result and repairs the little
+# that rounding leaves with a few augmenting paths.
+# TODO: Understand why the paper's threshold is too small
+# THRESHOLD = float(I.m * I.U) ** (-10)
+THRESHOLD = 1e-5
+ROUNDING_GAP = 1.0
+
+# Fraction of the previous probe's progress a warm-started binary search
+# probe keeps, and the least share of the initial cost gap it starts with.
+WARM_START_KEEP = 0.99999
+WARM_START_MIN_GAP = 1e-5
+
+# Line search on Φ along each cycle: the share of the distance to the nearest
+# bound a step may cover, the Armijo constant, how much a rejected step
+# shrinks, how often, and how much the next trial step grows over the last
+# accepted one. A run stops once the guaranteed decrease of Φ drops below
+# STALL_TOLERANCE relative to Φ.
+BOUNDARY_FRACTION = 0.99
+ARMIJO = 1e-4
+BACKTRACK = 0.5
+MAX_BACKTRACKS = 40
+STEP_GROWTH = 2.0
+STALL_TOLERANCE = 1e-12
+
+# The fixed step is eta * UPSCALE. A fixed step that would leave the bounds,
+# pass the optimum or not decrease Φ is rejected and retried at BACKTRACK
+# times its size, up to MAX_BACKTRACKS times.
+UPSCALE = 500
+
+ITERATIONS = benchmark.Counter("iterations")
+REJECTED_STEPS = benchmark.Counter("rejected_steps")
+EARLY_STOPPED_PROBES = benchmark.Counter("early_stopped_probes")
+EDGE_UPDATES = benchmark.Gauge("chen", "updates")
+
+# Howard's policy iterations when it starts from scratch, and when it starts
+# from the previous iteration's policy, which shows what warm starting saves
+COLD_SWEEPS = benchmark.Gauge("howard_cold", "sweeps")
+WARM_SWEEPS = benchmark.Gauge("howard_warm", "sweeps")
+
+# Where the time goes: building the instance, every run of the IPM, i.e.
+# every binary search probe, and each IPM iteration and its phases
+FEASIBLE_FLOW_TIME = benchmark.Timer("feasible_flow")
+RUN_TIME = benchmark.Timer("ipm_run")
+ITERATION_TIME = benchmark.Timer("ipm_iteration")
+CERTIFICATE_TIME = benchmark.Timer("certificate")
+CONSERVATION_TIME = benchmark.Timer("conservation_check")
+CYCLE_TIME = benchmark.Timer("min_cycle_ratio")
+STEP_TIME = benchmark.Timer("step")
+UPDATE_TIME = benchmark.Timer("update")
+
+
 def max_flow_with_guess(
     edges: list[Tuple[int, int]],
     capacities: list[int],
@@ -16,7 +78,52 @@ def max_flow_with_guess(
     t: int,
     optimal_flow: int,
     lower_capacities: list[int] = None,
+    warm_start: bool = True,
+    line_search: bool = True,
+    cleanup: bool = True,
+    initial_point: str = "midpoint",
+    upscale: float = UPSCALE,
 ):
+    """
+    Solve for the max flow with the IPM aimed at the guess optimal_flow, which
+    only gives the max flow for a correct guess. With cleanup, the IPM stops at
+    ROUNDING_GAP and repair_flow rounds its flow exactly.
+    """
+    I, cur_flow = build_instance(
+        edges, capacities, s, t, optimal_flow, lower_capacities, initial_point
+    )
+    original_m = len(edges) + 1
+    threshold = ROUNDING_GAP if cleanup else THRESHOLD
+    cur_flow, _ = run_ipm(
+        I,
+        cur_flow,
+        original_m,
+        warm_start,
+        line_search=line_search,
+        threshold=threshold,
+        upscale=upscale,
+    )
+
+    result = round_flow(cur_flow, len(edges))
+    if cleanup:
+        result = repair_flow(I, cur_flow, original_m) or result
+    return result
+
+
+def build_instance(
+    edges: list[Tuple[int, int]],
+    capacities: list[int],
+    s: int,
+    t: int,
+    optimal_flow: int,
+    lower_capacities: list[int] = None,
+    initial_point: str = "midpoint",
+) -> Tuple[MinCostFlow, np.ndarray]:
+    """
+    The min-cost flow instance with its auxiliary edges and a feasible flow on it,
+    from the capacity midpoint or, with initial_point "combinatorial", from
+    combinatorial_flow
+    """
     I = MinCostFlow.from_max_flow_instance(
         edges=edges,
         s=s,
@@ -42,9 +149,17 @@ def max_flow_with_guess(
         },
     )
 
-    original_m = I.m
-    flow_idx = original_m - 1
-    I, cur_flow = calc_feasible_flow(I)
+    benchmark.register("initial_point", initial_point)
+    start = FEASIBLE_FLOW_TIME.start()
+    if initial_point == "midpoint":
+        I, cur_flow = calc_feasible_flow(I)
+    else:
+        assert (
+            initial_point == "combinatorial"
+        ), f"Unknown initial point {initial_point}"
+        target = optimal_flow or np.inf
+        I, cur_flow = calc_feasible_flow(I, combinatorial_flow(I, target))
+    FEASIBLE_FLOW_TIME.stop(start)
 
     log("Feasible flow instance:")
     log(I)
@@ -53,13 +168,101 @@ def max_flow_with_guess(
     I.print_B()
     log()
 
-    # TODO: Understand why the paper's threshold is too small
-    # threshold = float(I.m * I.U) ** (-10)
-    threshold = 1e-5
+    return I, cur_flow
+
+
+def run_ipm(
+    I: MinCostFlow,
+    cur_flow: np.ndarray,
+    original_m: int,
+    warm_start: bool = True,
+    certificate: ProbeCertificate | None = None,
+    line_search: bool = True,
+    threshold: float = THRESHOLD,
+    upscale: float = UPSCALE,
+    deadline: float | None = None,
+) -> Tuple[np.ndarray, str | None]:
+    """
+    Run ipm_iterations on cur_flow in place until it ends or the deadline passes.
+    Returns the flow and the certificate's verdict, if any.
+    """
+    start = RUN_TIME.start()
+    iterations = ipm_iterations(
+        I,
+        cur_flow,
+        original_m,
+        warm_start,
+        certificate,
+        line_search,
+        threshold,
+        upscale,
+    )
+
+    i = 0
+    verdict = None
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            log("Out of time")
+            iterations.close()
+            break
+
+        try:
+            i = next(iterations).iteration
+        except StopIteration as stop:
+            verdict = stop.value
+            break
+
+    # A run that stopped short of the threshold may still have settled the guess
+    stopped = verdict is None and np.dot(I.c, cur_flow) - I.optimal_cost >= threshold
+    if certificate is not None and stopped:
+        verdict = certificate.check(cur_flow, -I.optimal_cost)
+    RUN_TIME.stop(start)
+
+    if certificate is not None:
+        register_probe(-I.optimal_cost, verdict, i)
+
+    log("rounded flow:", np.round(cur_flow[:original_m]))
+
+    return cur_flow, verdict
+
+
+def register_probe(guess: int, verdict: str | None, iterations: int):
+    outcome = {"guess": guess, "verdict": verdict, "iterations": iterations}
+    benchmark.append("probe_outcomes", outcome)
+    if verdict is not None:
+        EARLY_STOPPED_PROBES.add()
+
+
+@dataclass(slots=True)
+class IpmState:
+    """What ipm_iterations reports after each iteration"""
+
+    iteration: int
+    phi: float
+    gap: float  # c·f - optimal_cost
+    cycle_length: int
+    step: float
+
+
+def ipm_iterations(
+    I: MinCostFlow,
+    cur_flow: np.ndarray,
+    original_m: int,
+    warm_start: bool = True,
+    certificate: ProbeCertificate | None = None,
+    line_search: bool = True,
+    threshold: float = THRESHOLD,
+    upscale: float = UPSCALE,
+) -> Generator[IpmState, None, str | None]:
+    """
+    The IPM from cur_flow, updated in place, as a generator of an IpmState per
+    iteration. Returns the certificate's verdict if it settled the guess early.
+    """
+    flow_idx = original_m - 1
+
     log("Threshold:", threshold)
 
     kappa = 0.9999
-    upscale = 500
 
     benchmark.register(
         "parameters",
@@ -67,98 +270,511 @@ def max_flow_with_guess(
             "threshold": threshold,
             "kappa": kappa,
             "scalefactor": upscale,
+            "warm_start": warm_start,
+            "line_search": line_search,
         },
     )
 
+    howard = None
+    step = None
+    rejected = 0
+
     i = 0
-    cur_phi = I.phi(cur_flow)
-    while I.c.dot(cur_flow) - I.optimal_cost >= threshold:
-        i += 1
-        log("Iteration", i)
-        log("Φ(f) =", cur_phi)
+    potential = IncrementalPotential(I, cur_flow)
+    cur_phi = potential.phi()
+    try:
+        while potential.cost - I.optimal_cost >= threshold:
+            iteration_start = ITERATION_TIME.start()
+
+            if certificate is not None and i % CHECK_INTERVAL == 0:
+                start = CERTIFICATE_TIME.start()
+                verdict = certificate.check(cur_flow, -I.optimal_cost)
+                CERTIFICATE_TIME.stop(start)
+                if verdict is not None:
+                    log("Probe settled early:", verdict)
+                    return verdict
+
+            i += 1
+            log("Iteration", i)
+            log("Φ(f) =", cur_phi)
+
+            # Relative to U, as rounding error grows with the size of the flow
+            start = CONSERVATION_TIME.start()
+            assert np.max(np.abs(I.BT_dot(cur_flow))) < 1e-10 * max(
+                1.0, I.U
+            ), "Flow conservation has been broken"
+            CONSERVATION_TIME.stop(start)
+
+            gradients = potential.gradients
+            lengths = potential.lengths
+
+            start = CYCLE_TIME.start()
+            cold = howard is None or not warm_start
+            if cold:
+                howard = VectorizedHoward(I, gradients, lengths)
+            else:
+                howard.set_weights(gradients, lengths)
+
+            min_ratio, min_ratio_cycle = howard.find_optimum_cycle_ratio()
+            CYCLE_TIME.stop(start)
+            (COLD_SWEEPS if cold else WARM_SWEEPS).observe(howard.sweeps)
+            EDGE_UPDATES.observe(len(min_ratio_cycle))
+
+            assert min_ratio < 0, "Minimum cycle ratio is not negative"
+
+            start = STEP_TIME.start()
+            eta = -(kappa**2) / (50 * min_ratio_cycle.dot(gradients))
+            if line_search:
+                # Grow on from the last step, but never try less than the fixed one
+                trial = abs(eta * upscale)
+                if step is not None:
+                    trial = max(trial, STEP_GROWTH * abs(step))
+                step = line_search_step(potential, min_ratio_cycle, trial)
+            else:
+                step, retries = fixed_step(potential, min_ratio_cycle, eta * upscale)
+                rejected += retries
+            STEP_TIME.stop(start)
+            if step == 0:
+                log("Φ(f) has stalled")
+                return None
+
+            start = UPDATE_TIME.start()
+            potential.augment(min_ratio_cycle, step)
+            UPDATE_TIME.stop(start)
+
+            log("min_cycle_ratio =", min_ratio)
+            log("min_ratio_cycle =", min_ratio_cycle, "* step", step)
+            log("  -> cycle_edges:", [I.edges[e] for e in min_ratio_cycle.edges])
+            log(f"flow ({cur_flow[flow_idx]}): ", cur_flow)
+            log("original flow:", cur_flow[:original_m])
+
+            new_phi = potential.phi()
+            ITERATION_TIME.stop(iteration_start)
+            yield IpmState(
+                iteration=i,
+                phi=new_phi,
+                gap=potential.cost - I.optimal_cost,
+                cycle_length=len(min_ratio_cycle.edges),
+                step=step,
+            )
+
+            if not new_phi < cur_phi:
+                # Both steps guarantee a decrease, unless it is lost in rounding
+                log("Φ(f) has stalled")
+                return None
+            cur_phi = new_phi
+
+            log()
+
+        return None
+    finally:
+        ITERATIONS.add(i)
+        REJECTED_STEPS.add(rejected)
+
+
+def line_search_step(
+    potential: IncrementalPotential, cycle: Cycle, trial: float
+) -> float:
+    """
+    Backtracking line search for the signed amount of flow to route around the
+    cycle, 0 if no step decreases Φ(f) enough
+    """
+    slope = cycle.dot(potential.gradients)
+    sign = -1.0 if slope > 0 else 1.0
+    phi = potential.phi()
+
+    size = min(trial, BOUNDARY_FRACTION * potential.max_step(cycle, sign))
+    for _ in range(MAX_BACKTRACKS):
+        decrease = ARMIJO * size * abs(slope)
+        if decrease < STALL_TOLERANCE * max(1.0, abs(phi)):
+            break
+        if potential.phi_after(cycle, sign * size) <= phi - decrease:
+            return sign * size
+        size *= BACKTRACK
 
-        assert (
-            np.max(np.abs(I.B.T @ cur_flow)) < 1e-10
-        ), "Flow conservation has been broken"
+    return 0.0
+
+
+def fixed_step(
+    potential: IncrementalPotential, cycle: Cycle, step: float
+) -> Tuple[float, int]:
+    """
+    The fixed step, shrunk by BACKTRACK until Φ(f) decreases, or 0, and the number
+    of rejected steps
+    """
+    phi = potential.phi()
+    for retries in range(MAX_BACKTRACKS):
+        if potential.phi_after(cycle, step) < phi:
+            return step, retries
+        log("Rejected step", step)
+        step *= BACKTRACK
+
+    return 0.0, MAX_BACKTRACKS
 
-        gradients = I.calc_gradients(cur_flow)
-        lengths = I.calc_lengths(cur_flow)
 
-        min_ratio, min_ratio_cycle = minimum_cycle_ratio(I, gradients, lengths)
-        count_edge_updates(min_ratio_cycle)
+def round_flow(cur_flow: np.ndarray, flow_idx: int) -> Tuple[int, np.ndarray]:
+    return round(cur_flow[flow_idx]), np.round(cur_flow[:flow_idx])
+
 
-        assert min_ratio < 0, "Minimum cycle ratio is not negative"
+def pull_back(I: MinCostFlow, init_flow: np.ndarray, flow: np.ndarray) -> np.ndarray:
+    """
+    Move flow back towards init_flow to start the next probe, keeping
+    WARM_START_KEEP of the progress but at least WARM_START_MIN_GAP of the initial
+    gap
+    """
+    init_gap = np.dot(I.c, init_flow) - I.optimal_cost
+    if init_gap <= 0:
+        # init_flow already reaches the guess, so the probe ends at once
+        return init_flow.copy()
+    gap = np.dot(I.c, flow) - I.optimal_cost
 
-        eta = -(kappa**2) / (50 * gradients.dot(min_ratio_cycle))
-        augment_cycle = min_ratio_cycle * (eta * upscale)
+    keep = WARM_START_KEEP
+    if gap < WARM_START_MIN_GAP * init_gap:
+        keep = min(keep, (1 - WARM_START_MIN_GAP) * init_gap / (init_gap - gap))
 
-        cur_flow += augment_cycle
+    flow = init_flow + keep * (flow - init_flow)
+    I.repair_conservation(flow)
+    return flow
 
-        log("min_cycle_ratio =", min_ratio)
-        log("min_ratio_cycle =", augment_cycle)
-        log(
-            "  -> cycle_edges:",
-            [I.edges[e] for e, c in enumerate(min_ratio_cycle) if c != 0],
+
+def max_flow(
+    edges: list[Tuple[int, int]],
+    capacities: list[int],
+    s: int,
+    t: int,
+    lower_capacities: list[int] = None,
+    reuse_flow: bool = True,
+    workers: int = 1,
+    early_stop: bool = True,
+    strategy: str = "bisection",
+):
+    """
+    Binary search for the max flow value, warm-starting probes with reuse_flow and
+    ending them early with early_stop. See max_flow_parallel and max_flow_bounds for
+    workers and strategy.
+    """
+    if strategy == "bounds":
+        assert (
+            workers == 1 and early_stop
+        ), "The bounds strategy runs one probe at a time and needs its certificate"
+        return max_flow_bounds(edges, capacities, s, t, lower_capacities, reuse_flow)
+    assert strategy == "bisection", f"Unknown search strategy {strategy}"
+
+    if workers > 1:
+        return max_flow_parallel(
+            edges, capacities, s, t, lower_capacities, reuse_flow, workers, early_stop
         )
-        log(f"flow ({cur_flow[flow_idx]}): ", cur_flow)
-        log("original flow:", cur_flow[:original_m])
 
-        new_phi = I.phi(cur_flow)
-        if not new_phi < float("inf"):
-            log("Φ(f) has exploded")
-            break
+    max_possible_flow = sum(capacities[e] for e, (u, _) in enumerate(edges) if u == s)
 
-        # TODO: Understand why we don't always decrease Φ(f). Sign of gradient? Too large step?
-        assert new_phi < cur_phi, "Φ(f) has not decreased"
-        cur_phi = new_phi
+    benchmark.register("max_possible_flow", max_possible_flow)
+    benchmark.register("binary_search_reuse_flow", reuse_flow)
+    benchmark.register("binary_search_early_stop", early_stop)
 
-        log()
+    I, init_flow = build_instance(edges, capacities, s, t, 0, lower_capacities)
+    original_m = len(edges) + 1
+    certificate = ProbeCertificate(I, original_m) if early_stop else None
+    cur_flow = init_flow
 
-    benchmark.register_or_update("iterations", i, lambda x: x + i)
-    register_avg()
+    iters = 0
+    low, high = 0, max_possible_flow + 1
+    best, failed = None, None
+    while low < high:
+        iters += 1
 
-    log("rounded flow:", np.round(cur_flow[:original_m]))
+        mid = (low + high) // 2
+        I.optimal_cost = -mid
+        start = pull_back(I, init_flow, cur_flow) if reuse_flow else init_flow
+        cur_flow, verdict = run_ipm(
+            I, start.copy(), original_m, certificate=certificate
+        )
+        mf, flows = round_flow(cur_flow, len(edges))
 
-    return round(cur_flow[flow_idx]), np.round(cur_flow[:flow_idx])
+        if verdict == GUESS_TOO_HIGH or (verdict is None and mf < mid):
+            high = mid
+            failed = (mf, flows)
+        else:
+            low = mid + 1
+            best = (mid, cur_flow, verdict, (mf, flows))
 
+    benchmark.register("binary_search_iters", iters)
 
-def max_flow(
+    # TODO: fix this, I'm pretty sure this can be off by one
+    return finish_search(I, init_flow, original_m, best, failed)
+
+
+def max_flow_bounds(
     edges: list[Tuple[int, int]],
     capacities: list[int],
     s: int,
     t: int,
     lower_capacities: list[int] = None,
+    reuse_flow: bool = True,
 ):
+    """
+    Search that aims each probe at the upper bound from the last one's residual
+    cut, Newton-style, and bisects when that shrinks the interval by less than
+    half. The lower bound comes from the value of each probe's flow.
+    """
     max_possible_flow = sum(capacities[e] for e, (u, _) in enumerate(edges) if u == s)
 
     benchmark.register("max_possible_flow", max_possible_flow)
+    benchmark.register("binary_search_reuse_flow", reuse_flow)
+    benchmark.register("binary_search_strategy", "bounds")
+
+    I, init_flow = build_instance(edges, capacities, s, t, 0, lower_capacities)
+    original_m = len(edges) + 1
+    certificate = ProbeCertificate(I, original_m)
+    cur_flow = init_flow
 
     iters = 0
     low, high = 0, max_possible_flow + 1
-    mf, flows = None, None
-    while low < high:
+    best = (0, init_flow, GUESS_FEASIBLE, round_flow(init_flow, len(edges)))
+    guess = max_possible_flow
+    while low + 1 < high:
+        iters += 1
+
+        I.optimal_cost = -guess
+        start = pull_back(I, init_flow, cur_flow) if reuse_flow else init_flow
+        cur_flow, verdict = run_ipm(
+            I,
+            start.copy(),
+            original_m,
+            certificate=certificate,
+            threshold=ROUNDING_GAP,
+        )
+        mf, flows = round_flow(cur_flow, len(edges))
+        lower, upper = certificate.bounds(cur_flow)
+
+        width = high - low
+        if verdict is None and mf >= guess > best[0]:
+            best = (guess, cur_flow, None, (mf, flows))
+        if lower > best[0]:
+            best = (lower, cur_flow, GUESS_FEASIBLE, (mf, flows))
+        low = best[0]
+        if upper < high:
+            high = int(upper) + 1
+        if verdict == GUESS_TOO_HIGH or (verdict is None and mf < guess):
+            # A stalled IPM is no proof, so never drop below the lower bound
+            high = max(min(high, guess), low + 1)
+
+        guess = high - 1 if 2 * (high - low) <= width else (low + high) // 2
+
+    benchmark.register("binary_search_iters", iters)
+
+    return finish_search(I, init_flow, original_m, best, None)
+
+
+def finish_search(
+    I: MinCostFlow,
+    init_flow: np.ndarray,
+    original_m: int,
+    best: Tuple[int, np.ndarray, str | None, Tuple[int, np.ndarray]] | None,
+    failed: Tuple[int, np.ndarray] | None,
+) -> Tuple[int, np.ndarray]:
+    """
+    Repair the flow of the largest feasible guess, solved up to ROUNDING_GAP first
+    if a certificate cut it short
+    """
+    if best is None:
+        return repair_flow(I, failed[1], original_m) or failed
+
+    guess, flow, verdict, result = best
+    if verdict is None:
+        return repair_flow(I, flow, original_m) or result
+
+    I.optimal_cost = -guess
+    cur_flow, _ = run_ipm(
+        I, pull_back(I, init_flow, flow), original_m, threshold=ROUNDING_GAP
+    )
+    result = round_flow(cur_flow, original_m - 1)
+    return repair_flow(I, cur_flow, original_m) or result
+
+
+@dataclass
+class AnytimeResult:
+    """
+    The best valid flow max_flow_anytime found, if any, and proven bounds on the max
+    flow value
+    """
+
+    value: int | None
+    flows: np.ndarray | None
+    lower: int
+    upper: int
+    optimal: bool
+
+
+def max_flow_anytime(
+    edges: list[Tuple[int, int]],
+    capacities: list[int],
+    s: int,
+    t: int,
+    time_budget: float,
+    lower_capacities: list[int] = None,
+) -> AnytimeResult:
+    """
+    The binary search of max_flow within time_budget seconds, returning the best
+    valid flow found and proven bounds
+    """
+    deadline = time.monotonic() + time_budget
+    max_possible_flow = sum(capacities[e] for e, (u, _) in enumerate(edges) if u == s)
+
+    benchmark.register("max_possible_flow", max_possible_flow)
+    benchmark.register("time_budget", time_budget)
+
+    I, init_flow = build_instance(edges, capacities, s, t, 0, lower_capacities)
+    original_m = len(edges) + 1
+    certificate = ProbeCertificate(I, original_m)
+    cur_flow = init_flow
+
+    iters = 0
+    low, high = 0, max_possible_flow + 1
+    upper = max_possible_flow
+    best, failed = None, None
+    while low < high and time.monotonic() < deadline:
         iters += 1
 
         mid = (low + high) // 2
-        mf, flows = max_flow_with_guess(
-            edges,
-            capacities,
-            s=s,
-            t=t,
-            optimal_flow=mid,
-            lower_capacities=lower_capacities,
+        I.optimal_cost = -mid
+        cur_flow, verdict = run_ipm(
+            I,
+            pull_back(I, init_flow, cur_flow),
+            original_m,
+            certificate=certificate,
+            threshold=ROUNDING_GAP,
+            deadline=deadline,
         )
+        upper = int(min(upper, certificate.bounds(cur_flow)[1]))
+        mf, _ = round_flow(cur_flow, len(edges))
 
-        if mf < mid:
+        if verdict == GUESS_TOO_HIGH or (verdict is None and mf < mid):
             high = mid
+            failed = cur_flow
         else:
             low = mid + 1
+            best = cur_flow
 
     benchmark.register("binary_search_iters", iters)
-    register_avg()
 
-    # TODO: fix this, I'm pretty sure this can be off by one
-    return mf, flows
+    value, flows = None, None
+    candidates = [flow for flow in [best, failed, init_flow] if flow is not None]
+    result = repair_flow(I, candidates[0], original_m, require_max=False)
+    if result is not None:
+        value, flows = result
+    if certificate.no_lower_bounds and (value is None or value < 0):
+        value, flows = 0, np.zeros(len(edges))
+
+    # A repaired flow without augmenting paths left saturates a cut
+    lower = max(value or 0, 0)
+    if flows is not None:
+        upper = int(min(upper, certificate.original_cut_bound(flows)))
+
+    benchmark.register("anytime_bounds", (lower, upper))
+    return AnytimeResult(value, flows, lower, upper, lower == upper)
+
+
+def max_flow_parallel(
+    edges: list[Tuple[int, int]],
+    capacities: list[int],
+    s: int,
+    t: int,
+    lower_capacities: list[int] = None,
+    reuse_flow: bool = True,
+    workers: int = 4,
+    early_stop: bool = True,
+):
+    """k-ary search that probes one guess per worker process in each round"""
+    max_possible_flow = sum(capacities[e] for e, (u, _) in enumerate(edges) if u == s)
+
+    benchmark.register("max_possible_flow", max_possible_flow)
+    benchmark.register("binary_search_reuse_flow", reuse_flow)
+    benchmark.register("binary_search_workers", workers)
+    benchmark.register("binary_search_early_stop", early_stop)
+
+    I, init_flow = build_instance(edges, capacities, s, t, 0, lower_capacities)
+    original_m = len(edges) + 1
+    record = benchmark.current() is not None
+    previous = init_flow
+
+    rounds = 0
+    low, high = 0, max_possible_flow + 1
+    best, failed = None, None
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_probe_worker,
+        initargs=(I, init_flow, original_m, record, early_stop),
+    ) as pool:
+        while low < high:
+            rounds += 1
+
+            guesses = sorted(
+                {low + (high - low) * j // (workers + 1) for j in range(1, workers + 1)}
+            )
+            start = previous if reuse_flow else init_flow
+            results = pool.map(probe, guesses, [start] * len(guesses))
+
+            for guess, (mf, flows, probe_flow, verdict, run) in zip(guesses, results):
+                if run is not None:
+                    benchmark.merge(run)
+                    benchmark.append("probes", run.export())
+
+                if verdict == GUESS_TOO_HIGH or (verdict is None and mf < guess):
+                    if guess < high:
+                        high, failed = guess, (mf, flows)
+                elif guess >= low:
+                    low = guess + 1
+                    best = (guess, probe_flow, verdict, (mf, flows))
+                    previous = probe_flow
+
+    benchmark.register("binary_search_iters", rounds)
+
+    return finish_search(I, init_flow, original_m, best, failed)
+
+
+# The instance a probe worker process solves, set up by init_probe_worker
+PROBE_INSTANCE: (
+    Tuple[MinCostFlow, np.ndarray, int, bool, ProbeCertificate | None] | None
+) = None
+
+
+def init_probe_worker(
+    I: MinCostFlow,
+    init_flow: np.ndarray,
+    original_m: int,
+    record: bool,
+    early_stop: bool,
+):
+    global PROBE_INSTANCE
+    # A forked worker inherits the run the parent was recording
+    benchmark.CURRENT.set(None)
+    certificate = ProbeCertificate(I, original_m) if early_stop else None
+    PROBE_INSTANCE = (I, init_flow, original_m, record, certificate)
+
+
+def probe(guess: int, start: np.ndarray):
+    """
+    One probe of max_flow_parallel in a worker process, with its benchmark run if
+    recorded
+    """
+    I, init_flow, original_m, record, certificate = PROBE_INSTANCE
+    if not record:
+        return solve_probe(guess, start) + (None,)
+
+    with benchmark.recording(f"probe-{guess}") as run:
+        benchmark.register("guess", guess)
+        return solve_probe(guess, start) + (run,)
+
+
+def solve_probe(guess: int, start: np.ndarray):
+    I, init_flow, original_m, _, certificate = PROBE_INSTANCE
+
+    I.optimal_cost = -guess
+    cur_flow, verdict = run_ipm(
+        I, pull_back(I, init_flow, start), original_m, certificate=certificate
+    )
+    mf, flows = round_flow(cur_flow, original_m - 1)
+    return mf, flows, cur_flow, verdict
 
 
 if __name__ == "__main__":
@@ -180,28 +796,3 @@ if __name__ == "__main__":
     ans = max_flow(edges, capacities, s=0, t=5)
 
     print("Found max flow:", ans)
-
-
-def count_edge_updates(cycle: NDArray[np.float64]):
-    edge_updates = sum(x != 0.0 for x in cycle)
-    benchmark.register_or_update(
-        "chen_total_updates", edge_updates, lambda x: x + edge_updates
-    )
-    benchmark.register_or_update(
-        "chen_max_updates",
-        edge_updates,
-        lambda x: edge_updates if edge_updates > x else x,
-    )
-    benchmark.register_or_update(
-        "chen_min_updates",
-        edge_updates,
-        lambda x: edge_updates if edge_updates < x else x,
-    )
-    benchmark.register_or_update("chen_total_iterations", 1, lambda x: x + 1)
-
-
-def register_avg():
-    total_updates = benchmark.get_or_default("chen_total_updates", 0)
-    total_iters = benchmark.get_or_default("chen_total_iterations", 1)
-    if total_iters != None:
-        benchmark.register("chen_avg_updates", total_updates / total_iters)
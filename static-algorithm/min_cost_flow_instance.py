@@ -1,37 +1,53 @@
-from dataclasses import dataclass
-from typing import Tuple, Optional
+import math
+from collections.abc import Sequence
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Tuple, Optional
 import numpy as np
-from utils import log
+from cycle import Cycle
+from utils import ENABLE_LOG, log
 
+# Number of cycle updates after which IncrementalPotential recomputes
+# everything from scratch, to bound floating point drift.
+RECOMPUTE_INTERVAL = 100
 
-@dataclass
+
+@dataclass(slots=True)
 class MinCostFlow:
     m: int
     n: int
-    edges: list[Tuple[int, int]]
     c: np.ndarray
     u_upper: np.ndarray
     u_lower: np.ndarray
     optimal_cost: int
     U: int
     alpha: float
-    B: np.ndarray
 
-    undirected_edge_to_indices: dict[Tuple[int, int], list[int]]
-    adj: list[list[int]]
+    # Incidence structure: edge e goes from tail[e] to head[e], i.e. row e of
+    # the incidence matrix B has a 1 in column tail[e] and a -1 in head[e].
+    tail: np.ndarray
+    head: np.ndarray
+
+    # Caches derived from tail and head, dropped whenever the graph grows.
+    _incidence: Optional[Tuple[np.ndarray, np.ndarray]] = field(repr=False)
+    _pair_index: Optional[Tuple[np.ndarray, np.ndarray]] = field(repr=False)
+    _forest: Optional[Tuple[list[np.ndarray], np.ndarray]] = field(repr=False)
+    _buffers: dict[str, "EdgeBuffer"] = field(repr=False)  # Backing storage.
 
     def __init__(
         self,
-        edges: list[Tuple[int, int]],
+        edges: Iterable[Tuple[int, int]] | np.ndarray,
         c: np.ndarray,
         u_lower: np.ndarray,
         u_upper: np.ndarray,
         optimal_cost: int,
     ) -> None:
-        self.m = len(edges)
-        self.n = len(set(v for e in edges for v in e)) + 1
-        self.edges = edges
-        self.c_org = c
+        ends = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+        self.tail = ends[:, 0].copy()
+        self.head = ends[:, 1].copy()
+
+        self.m = len(ends)
+        self.n = len(np.unique(ends)) + 1
         self.u_lower = u_lower
         self.u_upper = u_upper
         self.optimal_cost = optimal_cost
@@ -39,9 +55,6 @@ class MinCostFlow:
         self.alpha = 1 / np.log2(1000 * self.m * self.U)
         self.c = c
 
-        assert (
-            len(self.edges) == self.m
-        ), f"Number of elements does not match: len(edges) = {len(self.edges)}, m = {self.m}"
         assert (
             len(self.c) == self.m
         ), f"Number of elements does not match: len(c) = {len(self.c)}, m = {self.m}"
@@ -52,28 +65,84 @@ class MinCostFlow:
             len(self.u_upper) == self.m
         ), f"Number of elements does not match: len(u_upper) = {len(self.u_upper)}, m = {self.m}"
 
-        self.B = np.zeros((self.m, self.n), dtype=int)
-        for e, (a, b) in enumerate(edges):
-            self.B[e, a] = 1
-            self.B[e, b] = -1
-
-        self.undirected_edge_to_indices = {}
-        for e, (a, b) in enumerate(edges):
-            if (a, b) not in self.undirected_edge_to_indices:
-                self.undirected_edge_to_indices[(a, b)] = []
-            if (b, a) not in self.undirected_edge_to_indices:
-                self.undirected_edge_to_indices[(b, a)] = []
-            self.undirected_edge_to_indices[(a, b)].append(e)
-            self.undirected_edge_to_indices[(b, a)].append(e)
-
-        self.adj = [[] for _ in range(self.n)]
-        for e, (a, b) in enumerate(edges):
-            self.adj[a].append(e)
-            self.adj[b].append(e)
+        self._incidence = None
+        self._pair_index = None
+        self._forest = None
+        self._buffers = {}
+
+    @property
+    def edges(self) -> "EdgeView":
+        """The edges as (tail, head) pairs, for code that reads I.edges[e]"""
+        return EdgeView(self)
+
+    def BT_dot(self, f: np.ndarray) -> np.ndarray:
+        """B^T f, i.e. the net flow out of each vertex"""
+        out = np.bincount(self.tail, weights=f, minlength=self.n)
+        into = np.bincount(self.head, weights=f, minlength=self.n)
+        return out - into
+
+    def incidence(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Incidence lists in CSR form: the edges touching vertex v are
+        edges[offsets[v]:offsets[v + 1]], in increasing order.
+        """
+        if self._incidence is None:
+            vertices = np.concatenate((self.tail, self.head))
+            edge_ids = np.tile(np.arange(self.m, dtype=np.int32), 2)
+            order = np.lexsort((edge_ids, vertices))
+
+            counts = np.bincount(vertices, minlength=self.n)
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            self._incidence = (offsets, edge_ids[order])
+
+        return self._incidence
+
+    def edges_at(self, vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """The edges touching each of vertices, and the vertex each one touches"""
+        offsets, edges = self.incidence()
+        if len(vertices) == 1:
+            v = vertices[0]
+            touching = edges[offsets[v] : offsets[v + 1]]
+            return touching, np.full(len(touching), v)
+
+        starts = offsets[vertices]
+        counts = offsets[vertices + 1] - starts
+        shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return edges[shift + np.arange(len(shift))], np.repeat(vertices, counts)
+
+    def bfs_layers(
+        self,
+        sources: np.ndarray,
+        reached: np.ndarray,
+        usable: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+    ) -> list[Tuple[np.ndarray, np.ndarray]]:
+        """New layers of a BFS from sources over usable edges, marked in reached, with the edge to each vertex"""
+        reached[sources] = True
+        frontier = sources
+        layers = []
+        while True:
+            # Only the edges at the newest layer can reach new vertices
+            edges, v = self.edges_at(frontier)
+            w = self.tail[edges] + self.head[edges] - v
+            new = ~reached[w]
+            if usable is not None:
+                new &= usable(edges, v)
+            frontier, first = np.unique(w[new], return_index=True)
+            if len(frontier) == 0:
+                return layers
+
+            reached[frontier] = True
+            layers.append((frontier, edges[new][first]))
 
     def print_B(self):
+        if not ENABLE_LOG:
+            return
+
         log(f"{'vertices:': >10} ", " ".join([f"{i: >2}" for i in range(self.n)]))
-        for e, row in enumerate(self.B):
+        for e in range(self.m):
+            row = np.zeros(self.n, dtype=int)
+            row[self.tail[e]] = 1
+            row[self.head[e]] = -1
             log(f"{e: <2} {str(self.edges[e]): <7}", row)
 
     @staticmethod
@@ -92,9 +161,9 @@ class MinCostFlow:
         if lower_capacities is None:
             u_lower = np.zeros(len(new_edges), dtype=float)
         else:
-            u_lower = np.array(lower_capacities + [0])
+            u_lower = np.array(lower_capacities + [0], dtype=float)
 
-        u_upper = np.array(capacities + [sum(capacities)])
+        u_upper = np.array(capacities + [sum(capacities)], dtype=float)
 
         I = MinCostFlow(
             edges=new_edges,
@@ -103,17 +172,19 @@ class MinCostFlow:
             c=c,
             optimal_cost=-optimal_flow,
         )
+        # Room for an auxiliary edge per vertex, added by calc_feasible_flow
+        I.reserve(I.n)
 
         return I
 
     def phi(self, f: np.ndarray) -> float:
+        """Φ(f), which is inf for flows outside the bounds or past the optimum"""
         cur_cost = np.dot(self.c, f)
 
-        objective = 20 * self.m * np.log2(cur_cost - self.optimal_cost)
+        objective = objective_term(self.m, cur_cost - self.optimal_cost)
 
-        upper_barriers = (self.u_upper - f) ** (-self.alpha)
-        lower_barriers = (f - self.u_lower) ** (-self.alpha)
-        barrier = np.sum(upper_barriers + lower_barriers)
+        barriers, _, _ = barrier_terms(self.u_upper - f, f - self.u_lower, self.alpha)
+        barrier = np.sum(barriers)
 
         phi = objective + barrier
 
@@ -122,48 +193,340 @@ class MinCostFlow:
     def calc_gradients(self, f: np.ndarray) -> np.ndarray:
         cur_cost = np.dot(self.c, f)
 
-        objective = 20 * self.m * ((cur_cost - self.optimal_cost) ** (-1)) * self.c
+        objective = objective_scale(self.m, cur_cost - self.optimal_cost) * self.c
 
-        left = self.alpha * (self.u_upper - f) ** (-1 - self.alpha)
-        right = self.alpha * (f - self.u_lower) ** (-1 - self.alpha)
+        _, left, right = barrier_terms(self.u_upper - f, f - self.u_lower, self.alpha)
 
-        return objective + left - right
+        return objective + self.alpha * (left - right)
 
     def calc_lengths(self, f: np.ndarray) -> np.ndarray:
-        left = (self.u_upper - f) ** (-1 - self.alpha)
-        right = (f - self.u_lower) ** (-1 - self.alpha)
+        _, left, right = barrier_terms(self.u_upper - f, f - self.u_lower, self.alpha)
         return left + right
 
     def edges_between(self, a: int, b: int) -> list[int]:
-        return self.undirected_edge_to_indices[(a, b)]
+        """Edges between a and b in either direction, in increasing order"""
+        if self._pair_index is None:
+            keys = _pair_keys(self.tail, self.head)
+            order = np.argsort(keys, kind="stable")
+            self._pair_index = (keys[order], order)
+
+        keys, order = self._pair_index
+        key = _pair_keys(np.array([a]), np.array([b]))[0]
+        lo = np.searchsorted(keys, key, side="left")
+        hi = np.searchsorted(keys, key, side="right")
+        return order[lo:hi].tolist()
+
+    def repair_conservation(self, f: np.ndarray):
+        """Push the rounding error in B^T f up a spanning forest to its roots, in place"""
+        layers, parent_edge = self._spanning_forest()
+        excess = self.BT_dot(f)
+
+        for layer in reversed(layers[1:]):
+            edges = parent_edge[layer]
+            # Raising the flow out of v lowers its excess, raising the flow into v raises it
+            f[edges] += np.where(self.tail[edges] == layer, -1, 1) * excess[layer]
+            parents = self.tail[edges] + self.head[edges] - layer
+            np.add.at(excess, parents, excess[layer])
+
+    def _spanning_forest(self) -> Tuple[list[np.ndarray], np.ndarray]:
+        """A BFS forest as its layers of vertices, roots first, and each vertex's parent edge"""
+        if self._forest is not None:
+            return self._forest
+
+        offsets, _ = self.incidence()
+        reached = np.zeros(self.n, dtype=bool)
+        parent_edge = np.full(self.n, -1)
+
+        # Isolated vertices are trees of their own, without a BFS each
+        isolated = np.flatnonzero(offsets[1:] == offsets[:-1])
+        reached[isolated] = True
+        layers: list[list[np.ndarray]] = [[isolated]]
+
+        for root in range(self.n):
+            if reached[root]:
+                continue
+
+            layers[0].append(np.array([root]))
+            bfs = self.bfs_layers(np.array([root]), reached)
+            for level, (frontier, edges) in enumerate(bfs, start=1):
+                if len(layers) <= level:
+                    layers.append([])
+                layers[level].append(frontier)
+                parent_edge[frontier] = edges
+
+        self._forest = ([np.concatenate(layer) for layer in layers], parent_edge)
+        return self._forest
 
     def add_vertex(self):
         self.n += 1
-        self.B = np.pad(self.B, ((0, 0), (0, 1)), mode="constant", constant_values=0)
+        self._incidence = None
+        self._forest = None
 
         return self.n - 1
 
     def add_edge(self, a: int, b: int, c: int, u_lower: int, u_upper: int):
-        # FIXME: This might be really slow
-        assert a < self.n
-        assert b < self.n
-
-        self.edges.append((a, b))
-        if (a, b) not in self.undirected_edge_to_indices:
-            self.undirected_edge_to_indices[(a, b)] = []
-        if (b, a) not in self.undirected_edge_to_indices:
-            self.undirected_edge_to_indices[(b, a)] = []
-        self.undirected_edge_to_indices[(a, b)].append(len(self.edges) - 1)
-        self.undirected_edge_to_indices[(b, a)].append(len(self.edges) - 1)
-
-        self.adj.append([])
-        self.adj[a].append(len(self.edges) - 1)
-        self.adj[b].append(len(self.edges) - 1)
-
-        self.m += 1
-        self.c = np.append(self.c, c)
-        self.u_lower = np.append(self.u_lower, u_lower)
-        self.u_upper = np.append(self.u_upper, u_upper)
-        self.B = np.pad(self.B, ((0, 1), (0, 0)), mode="constant", constant_values=0)
-        self.B[-1, a] = 1
-        self.B[-1, b] = -1
+        return self.add_edges(
+            tails=np.array([a]),
+            heads=np.array([b]),
+            c=np.array([c]),
+            u_lower=np.array([u_lower]),
+            u_upper=np.array([u_upper]),
+        )[0]
+
+    def add_edges(
+        self,
+        tails: np.ndarray,
+        heads: np.ndarray,
+        c: np.ndarray,
+        u_lower: np.ndarray,
+        u_upper: np.ndarray,
+    ) -> np.ndarray:
+        """Add the edges tails[i] -> heads[i] in amortized O(1) each and return their indices"""
+        k = len(tails)
+        assert len(heads) == k and len(c) == k
+        assert len(u_lower) == k and len(u_upper) == k
+        assert k == 0 or (np.max(tails) < self.n and np.max(heads) < self.n)
+
+        first = self.m
+        self.m += k
+        new = {"c": c, "u_lower": u_lower, "u_upper": u_upper}
+        new |= {
+            "tail": np.asarray(tails, dtype=np.int32),
+            "head": np.asarray(heads, dtype=np.int32),
+        }
+        for name, values in new.items():
+            setattr(self, name, self._append(name, values, first))
+        self._incidence = None
+        self._pair_index = None
+        self._forest = None
+
+        return np.arange(first, self.m)
+
+    def reserve(self, extra: int):
+        """Move the per-edge arrays into buffers with room for extra more edges"""
+        for name in ["c", "u_lower", "u_upper", "tail", "head"]:
+            current = getattr(self, name)
+            buffer = EdgeBuffer(np.empty(self.m + extra, dtype=current.dtype), self.m)
+            buffer.data[: self.m] = current
+            self._buffers[name] = buffer
+            setattr(self, name, buffer.data[: self.m])
+
+    def overlay(self) -> "MinCostFlow":
+        """A copy that add_vertex and add_edges grow in this one's spare buffer room, leaving it unchanged"""
+        I = copy(self)
+        I._buffers = dict(self._buffers)
+        return I
+
+    def _append(self, name: str, values: np.ndarray, first: int) -> np.ndarray:
+        """Write values after the first entries of a per-edge array and return its new view"""
+        current = getattr(self, name)
+        buffer = self._buffers.get(name)
+        dtype = np.result_type(current, values)
+
+        # Reallocate when full, when the dtype must widen, when the array was
+        # replaced or copied (e.g. by deepcopy) and no longer views the buffer,
+        # or when another instance sharing the buffer already wrote past first.
+        # Only a buffer that already grew doubles, so an overlay that grows
+        # once, like the one of calc_feasible_flow, holds no spare capacity.
+        if (
+            buffer is None
+            or len(buffer.data) < self.m
+            or buffer.data.dtype != dtype
+            or current.base is not buffer.data
+            or buffer.used != first
+        ):
+            grown = buffer is not None and current.base is buffer.data
+            size = max(self.m, 2 * first) if grown else self.m
+            buffer = EdgeBuffer(np.empty(size, dtype=dtype), first)
+            buffer.data[:first] = current
+            self._buffers[name] = buffer
+
+        buffer.data[first : self.m] = values
+        buffer.used = self.m
+        return buffer.data[: self.m]
+
+
+class EdgeBuffer:
+    """Storage of a per-edge array, and how much of it the instances sharing it used"""
+
+    __slots__ = ("data", "used")
+
+    data: np.ndarray
+    used: int
+
+    def __init__(self, data: np.ndarray, used: int) -> None:
+        self.data = data
+        self.used = used
+
+
+def barrier_terms(
+    upper_gap: np.ndarray, lower_gap: np.ndarray, alpha: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The barrier gap^-alpha over both bounds and gap^(-1 - alpha) per bound, inf for gaps <= 0"""
+    # Powers as exponentials of log(gap) overflow to inf quietly instead of nan
+    with np.errstate(divide="ignore", over="ignore"):
+        log_upper = np.log(np.maximum(upper_gap, 0.0))
+        log_lower = np.log(np.maximum(lower_gap, 0.0))
+        barriers = np.exp(-alpha * log_upper) + np.exp(-alpha * log_lower)
+        left = np.exp((-1 - alpha) * log_upper)
+        right = np.exp((-1 - alpha) * log_lower)
+    return barriers, left, right
+
+
+def objective_term(m: int, gap: float) -> float:
+    """The objective 20m·log2(c·f - optimal_cost) of Φ, inf once the gap closes"""
+    return 20 * m * math.log2(gap) if gap > 0 else math.inf
+
+
+def objective_scale(m: int, gap: float) -> float:
+    """The objective's derivative 20m / (c·f - optimal_cost), up to a factor c"""
+    return 20 * m / gap if gap > 0 else math.inf
+
+
+def _pair_keys(tails: np.ndarray, heads: np.ndarray) -> np.ndarray:
+    """Key identifying the unordered pair {tail, head} of each edge"""
+    lo = np.minimum(tails, heads).astype(np.int64)
+    hi = np.maximum(tails, heads).astype(np.int64)
+    return (lo << 32) | hi
+
+
+class EdgeView(Sequence):
+    """Read-only view of the edges of a MinCostFlow as (tail, head) pairs"""
+
+    __slots__ = ("I",)
+
+    I: MinCostFlow
+
+    def __init__(self, I: MinCostFlow) -> None:
+        self.I = I
+
+    def __len__(self) -> int:
+        return self.I.m
+
+    def __getitem__(self, e):
+        if isinstance(e, slice):
+            return [self[i] for i in range(*e.indices(len(self)))]
+        if not -self.I.m <= e < self.I.m:
+            raise IndexError("edge index out of range")
+        return (int(self.I.tail[e]), int(self.I.head[e]))
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.I.tail.tolist(), self.I.head.tolist())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class IncrementalPotential:
+    """Φ(f), its gradients and the edge lengths, updated per augmented cycle in O(k + nnz(c))"""
+
+    I: MinCostFlow
+    f: np.ndarray
+    cost: float
+    barrier: float
+    barriers: np.ndarray
+    barrier_gradients: np.ndarray
+    gradients: np.ndarray
+    lengths: np.ndarray
+
+    cost_support: np.ndarray  # Edges with non-zero cost.
+    updates: int
+
+    def __init__(
+        self,
+        I: MinCostFlow,
+        f: np.ndarray,
+        recompute_interval: int = RECOMPUTE_INTERVAL,
+    ) -> None:
+        self.I = I
+        self.f = f
+        self.recompute_interval = recompute_interval
+        self.cost_support = np.flatnonzero(I.c)
+        self.recompute()
+
+    def recompute(self):
+        """Recompute all cached terms from the current flow"""
+        I = self.I
+        self.updates = 0
+        self.cost = float(np.dot(I.c, self.f))
+
+        self.barriers, left, right = barrier_terms(
+            I.u_upper - self.f, self.f - I.u_lower, I.alpha
+        )
+        self.barrier = float(np.sum(self.barriers))
+        self.barrier_gradients = I.alpha * (left - right)
+        self.lengths = left + right
+
+        # Only on the edges with a cost, as the scale is inf past the optimum
+        support = self.cost_support
+        self.gradients = self.barrier_gradients.copy()
+        self.gradients[support] += self._objective_scale() * I.c[support]
+
+    def _objective_scale(self) -> float:
+        return objective_scale(self.I.m, self.cost - self.I.optimal_cost)
+
+    def _update_edges(self, edges: np.ndarray):
+        """Recompute the per-edge terms of the given edges"""
+        I = self.I
+        barriers, left, right = barrier_terms(
+            I.u_upper[edges] - self.f[edges], self.f[edges] - I.u_lower[edges], I.alpha
+        )
+        self.barrier += float(np.sum(barriers) - np.sum(self.barriers[edges]))
+        self.barriers[edges] = barriers
+        self.barrier_gradients[edges] = I.alpha * (left - right)
+        self.lengths[edges] = left + right
+        self.gradients[edges] = self.barrier_gradients[edges]
+
+    def augment(self, cycle: Cycle, amount: float):
+        """Route amount units of flow around the cycle and update the cached terms"""
+        cycle.augment(self.f, amount)
+
+        self.updates += 1
+        if self.updates >= self.recompute_interval:
+            self.recompute()
+            return
+
+        self.cost += amount * cycle.dot(self.I.c)
+        self._update_edges(cycle.edges)
+
+        # The objective's share of the gradient changes with the cost
+        support = self.cost_support
+        self.gradients[support] = (
+            self.barrier_gradients[support]
+            + self._objective_scale() * self.I.c[support]
+        )
+
+    def phi(self) -> float:
+        return self._objective(self.cost) + self.barrier
+
+    def phi_after(self, cycle: Cycle, amount: float) -> float:
+        """Φ after routing amount units around the cycle, inf past the bounds or the optimum"""
+        I, edges = self.I, cycle.edges
+        f = self.f[edges] + amount * cycle.directions
+        barriers, _, _ = barrier_terms(
+            I.u_upper[edges] - f, f - I.u_lower[edges], I.alpha
+        )
+        barrier = self.barrier + float(np.sum(barriers) - np.sum(self.barriers[edges]))
+        return self._objective(self.cost + amount * cycle.dot(I.c)) + barrier
+
+    def max_step(self, cycle: Cycle, sign: float = 1.0) -> float:
+        """Flow that fits around the cycle, against it for a negative sign, within bounds and optimum"""
+        I, edges = self.I, cycle.edges
+        directions = sign * cycle.directions
+        room = np.where(
+            directions > 0,
+            I.u_upper[edges] - self.f[edges],
+            self.f[edges] - I.u_lower[edges],
+        )
+        step = float(np.min(room / np.abs(directions)))
+
+        cost_change = sign * cycle.dot(I.c)
+        if cost_change < 0:
+            step = min(step, (self.cost - I.optimal_cost) / -cost_change)
+        return step
+
+    def _objective(self, cost: float) -> float:
+        return objective_term(self.I.m, cost - self.I.optimal_cost)
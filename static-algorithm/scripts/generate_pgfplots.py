@@ -1,6 +1,9 @@
 import sys
 from math import log2
-import json
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from benchmark import load_benchmarks  # noqa: E402
 
 
 def varying_capacity(benches):
@@ -9,10 +12,19 @@ def varying_capacity(benches):
 
     items = [x for x in items if x["bench_config"]["file"] == "dag_edges_25.txt"]
 
-    xs = [x["bench_config"]["scale_capacity"] for x in items]
-    ys = [x["iterations"]/log2(x["max_possible_flow"]) for x in items]
+    # One plot per search strategy, older benchmarks only used bisection
+    strategies = sorted({x["bench_config"].get("strategy", "bisection") for x in items})
+    for strategy in strategies:
+        runs = [
+            x
+            for x in items
+            if x["bench_config"].get("strategy", "bisection") == strategy
+        ]
+
+        xs = [x["bench_config"]["scale_capacity"] for x in runs]
+        ys = [x["iterations"]/log2(x["max_possible_flow"]) for x in runs]
 
-    print(make_pgfplots_coords(xs, ys))
+        print(f"{strategy}:", make_pgfplots_coords(xs, ys))
 
 
 def make_pgfplots_coords(xs, ys):
@@ -20,9 +32,7 @@ def make_pgfplots_coords(xs, ys):
 
 
 if __name__ == "__main__":
-    bench_path = sys.argv[1]
-
-    with open(bench_path, "r") as f:
-        benches = json.load(f)
+    # Either the .json of write_benchmark or the .jsonl of a benchmark stream
+    benches = load_benchmarks(sys.argv[1])
 
     varying_capacity(benches)
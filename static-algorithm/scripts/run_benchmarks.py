@@ -0,0 +1,264 @@
+"""
+Run a matrix of dataset files x solvers x capacity scales, each cell
+repeated a number of times, in parallel worker processes with a timeout
+per run, and print the median and interquartile range of the wall time
+and iterations of every cell. Every finished run is also streamed to a
+JSONL file that load_benchmarks reads.
+
+    python scripts/run_benchmarks.py --files dag_edges_25.txt line_edges_25.txt \
+        --solvers ipm_guess edmonds_karp --scales 1 10 --repetitions 5
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import benchmark  # noqa: E402
+from flows import MaxFlow, PushRelabel, cap_find_max_flow  # noqa: E402
+from main import max_flow, max_flow_with_guess  # noqa: E402
+from tests.test_bench import DAG_FILES, FULLY_CONNECTED_FILES, LINE_FILES  # noqa: E402
+from tests.test_random import parse_input  # noqa: E402
+from tests.utils import make_edges_and_capacities  # noqa: E402
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+
+def solve_ipm_guess(edges, capacities, s, t, expected):
+    value, _ = max_flow_with_guess(edges, capacities, s=s, t=t, optimal_flow=expected)
+    return value
+
+
+def solve_ipm_guess_combinatorial(edges, capacities, s, t, expected):
+    value, _ = max_flow_with_guess(
+        edges,
+        capacities,
+        s=s,
+        t=t,
+        optimal_flow=expected,
+        initial_point="combinatorial",
+    )
+    return value
+
+
+def solve_ipm_binary_search(edges, capacities, s, t, expected):
+    value, _ = max_flow(edges, capacities, s=s, t=t)
+    return value
+
+
+def solve_capacity_scaling(edges, capacities, s, t, expected):
+    value, _ = cap_find_max_flow(edges, capacities, s, t)
+    return value
+
+
+def solve_edmonds_karp(edges, capacities, s, t, expected):
+    return MaxFlow(edges, capacities).max_flow(s, t)
+
+
+def solve_push_relabel(edges, capacities, s, t, expected):
+    return PushRelabel(edges, capacities).max_flow(s, t)
+
+
+# Every solver, with the key of the exported run data counting its iterations
+SOLVERS = {
+    "ipm_guess": (solve_ipm_guess, "iterations"),
+    "ipm_guess_combinatorial": (solve_ipm_guess_combinatorial, "iterations"),
+    "ipm_binary_search": (solve_ipm_binary_search, "iterations"),
+    "capacity_scaling": (solve_capacity_scaling, "capacity_total_iterations"),
+    "edmonds_karp": (solve_edmonds_karp, "edmond_total_iterations"),
+    "push_relabel": (solve_push_relabel, "push_relabel_total_iterations"),
+}
+
+
+@dataclass(frozen=True)
+class Cell:
+    file: str
+    solver: str
+    scale_capacity: int
+
+    def id(self) -> str:
+        return f"{self.file}-{self.solver}-{self.scale_capacity}"
+
+
+@dataclass
+class Outcome:
+    """The runs of one cell: wall times and iterations of the finished ones"""
+
+    times: list[float] = field(default_factory=list)
+    iterations: list[float] = field(default_factory=list)
+    wrong: int = 0
+    timeouts: int = 0
+    errors: int = 0
+
+
+def run_cell(cell: Cell, repetition: int, conn: Connection):
+    """
+    One run of a cell in a worker process. The expected value, which the
+    IPM with a guess needs and all results are checked against, is found
+    with capacity scaling before the clock starts.
+    """
+    try:
+        with open(DATA_DIR / cell.file) as f:
+            graph, s, t = parse_input(f.read())
+        edges, capacities, _ = make_edges_and_capacities(graph)
+        capacities = [c * cell.scale_capacity for c in capacities]
+        expected, _ = cap_find_max_flow(edges, capacities, s, t)
+
+        solve, iterations_key = SOLVERS[cell.solver]
+        with benchmark.recording(cell.id()):
+            benchmark.register(
+                "bench_config",
+                {
+                    "file": cell.file,
+                    "solver": cell.solver,
+                    "scale_capacity": cell.scale_capacity,
+                    "repetition": repetition,
+                },
+            )
+            start = time.perf_counter()
+            value = solve(edges, capacities, s, t, expected)
+            elapsed = time.perf_counter() - start
+
+            benchmark.register("actual_max_flow", expected)
+            benchmark.register("max_flow_result", value)
+            benchmark.register("duration_s", elapsed)
+            data = benchmark.current().export()
+
+        conn.send(("done", data, data.get(iterations_key, 0)))
+    except Exception as e:
+        conn.send(("error", repr(e), None))
+    finally:
+        conn.close()
+
+
+def run_matrix(
+    cells: list[Cell],
+    repetitions: int,
+    timeout: float,
+    workers: int,
+    sink: benchmark.JsonlSink,
+) -> dict[Cell, Outcome]:
+    """
+    Run every cell repetitions times, at most workers runs at a time, each
+    in a process of its own, which is killed once it has run for timeout
+    seconds. A pool of long lived workers could not stop a hung run.
+    """
+    outcomes = {cell: Outcome() for cell in cells}
+    pending = [(cell, r) for r in range(repetitions) for cell in cells]
+    pending.reverse()
+    running: dict[Connection, tuple[Cell, multiprocessing.Process, float]] = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            cell, repetition = pending.pop()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=run_cell, args=(cell, repetition, sender), daemon=True
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (cell, process, time.monotonic() + timeout)
+
+        next_deadline = min(deadline for _, _, deadline in running.values())
+        ready = wait(list(running), max(0.0, next_deadline - time.monotonic()))
+
+        for conn in list(running):
+            cell, process, deadline = running[conn]
+            outcome = outcomes[cell]
+            if conn in ready:
+                try:
+                    status, data, iterations = conn.recv()
+                except EOFError:  # The worker died without an answer
+                    status, data = "error", f"exit code {process.exitcode}"
+            elif time.monotonic() >= deadline:
+                process.kill()
+                status, data = "timeout", None
+            else:
+                continue
+
+            del running[conn]
+            conn.close()
+            process.join()
+            if status == "done":
+                repetition = data["bench_config"]["repetition"]
+                sink.write(f"{cell.id()}-{repetition}", data)
+                outcome.times.append(data["duration_s"])
+                outcome.iterations.append(iterations)
+                if data["max_flow_result"] != data["actual_max_flow"]:
+                    outcome.wrong += 1
+            elif status == "timeout":
+                print("Timed out:", cell, file=sys.stderr)
+                outcome.timeouts += 1
+            else:
+                print("Failed:", cell, data, file=sys.stderr)
+                outcome.errors += 1
+
+    return outcomes
+
+
+def median_iqr(values: list[float]) -> tuple[float, float]:
+    if not values:
+        return np.nan, np.nan
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    return float(median), float(q3 - q1)
+
+
+def print_table(outcomes: dict[Cell, Outcome]):
+    header = (
+        f"{'file':<32} {'solver':<24} {'scale':>6} {'ok':>4} {'wrong':>5} "
+        f"{'timeout':>7} {'error':>5} {'time [s]':>9} {'IQR':>9} "
+        f"{'iters':>8} {'IQR':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for cell, outcome in outcomes.items():
+        time_median, time_iqr = median_iqr(outcome.times)
+        iters_median, iters_iqr = median_iqr(outcome.iterations)
+        print(
+            f"{cell.file:<32} {cell.solver:<24} {cell.scale_capacity:>6} "
+            f"{len(outcome.times):>4} {outcome.wrong:>5} {outcome.timeouts:>7} "
+            f"{outcome.errors:>5} {time_median:>9.4f} {time_iqr:>9.4f} "
+            f"{iters_median:>8.1f} {iters_iqr:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--files",
+        nargs="+",
+        default=DAG_FILES + FULLY_CONNECTED_FILES + LINE_FILES,
+        help="dataset files, relative to data/",
+    )
+    parser.add_argument(
+        "--solvers", nargs="+", default=list(SOLVERS), choices=list(SOLVERS)
+    )
+    parser.add_argument("--scales", nargs="+", type=int, default=[1])
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds per run")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument(
+        "--output",
+        default=Path("benches") / f"matrix-{int(time.time())}.jsonl",
+        help="JSONL file the finished runs are appended to",
+    )
+    args = parser.parse_args()
+
+    cells = [
+        Cell(file, solver, scale)
+        for file in args.files
+        for solver in args.solvers
+        for scale in args.scales
+    ]
+    sink = benchmark.JsonlSink(args.output)
+    try:
+        outcomes = run_matrix(cells, args.repetitions, args.timeout, args.workers, sink)
+    finally:
+        sink.close()
+    print_table(outcomes)
@@ -25,9 +25,10 @@ class Config:
     binary_search: bool = False
     scale_capacity: int = 1
     correct_answer: int | None = None
+    strategy: str = "bisection"
 
     def id(self):
-        h = hash((self.file, self.binary_search, self.scale_capacity))
+        h = hash((self.file, self.binary_search, self.scale_capacity, self.strategy))
         return f"{self.file}-{h}"
 
     def register_params(self):
@@ -37,6 +38,7 @@ class Config:
                 "file": self.file,
                 "binary_search": self.binary_search,
                 "scale_capacity": self.scale_capacity,
+                "strategy": self.strategy,
             },
         )
 
@@ -62,7 +64,7 @@ def eval_files(configs: List[Config]):
             actual_max_flow = find_max_flow(edges, capacities, s=s, t=t)
 
         if config.binary_search:
-            mf, flows = max_flow(edges, capacities, s=s, t=t)
+            mf, flows = max_flow(edges, capacities, s=s, t=t, strategy=config.strategy)
         else:
             mf, flows = max_flow_with_guess(
                 edges, capacities, s=s, t=t, optimal_flow=actual_max_flow
@@ -142,7 +144,15 @@ def test_bench_binary_search():
     configs = []
     for f in files:
         for scale in [1, 2, 4, 8, 16, 32, 64, 128, 256]:
-            configs.append(Config(file=f, binary_search=True, scale_capacity=scale))
+            for strategy in ["bisection", "bounds"]:
+                configs.append(
+                    Config(
+                        file=f,
+                        binary_search=True,
+                        scale_capacity=scale,
+                        strategy=strategy,
+                    )
+                )
 
     eval_files(configs)
 
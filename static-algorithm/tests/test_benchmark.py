@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import benchmark
+
+STEPS = benchmark.Counter("steps")
+UPDATES = benchmark.Gauge("test", "updates")
+SLEEP = benchmark.Timer("sleep")
+
+
+def record(id: str, values: list[int]) -> benchmark.Run:
+    with benchmark.recording(id) as run:
+        for value in values:
+            start = SLEEP.start()
+            STEPS.add()
+            UPDATES.observe(value)
+            SLEEP.stop(start)
+        benchmark.append("values", values)
+    return run
+
+
+def test_counters_and_gauges():
+    run = record("run", [3, 1, 2])
+    data = run.export()
+
+    assert data["steps"] == 3
+    assert data["values"] == [[3, 1, 2]]
+    assert data["test_total_updates"] == 6
+    assert data["test_min_updates"] == 1
+    assert data["test_max_updates"] == 3
+    assert data["test_avg_updates"] == 2
+    assert data["test_total_iterations"] == 3
+    assert data["time_sleep_count"] == 3
+
+
+def test_runs_in_threads_are_separate():
+    assert benchmark.current() is None
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        runs = list(pool.map(record, ["a", "b"], [[1] * 100, [2] * 50]))
+
+    assert [run.counters["steps"] for run in runs] == [100, 50]
+    assert benchmark.current() is None
+
+
+def test_timer():
+    assert SLEEP.start() == 0
+
+    with benchmark.recording("run") as run:
+        for _ in range(3):
+            start = SLEEP.start()
+            time.sleep(0.002)
+            SLEEP.stop(start)
+    data = run.export()
+
+    assert data["time_sleep_count"] == 3
+    assert data["time_sleep_ns"] >= 3 * 2_000_000
+    # 2 ms lie between 2^20 and 2^21 ns
+    histogram = data["time_sleep_histogram"]
+    assert sum(histogram.values()) == 3 and min(histogram) >= 21
+
+
+def test_merge():
+    with benchmark.recording("parent") as parent:
+        STEPS.add(10)
+        benchmark.register("kept", True)
+        for run in [record("a", [5, 4]), record("b", [7])]:
+            run.info["kept"] = False
+            benchmark.merge(run)
+
+    data = parent.export()
+    assert data["kept"] and data["steps"] == 13
+    assert data["values"] == [[5, 4], [7]]
+    assert (data["test_min_updates"], data["test_max_updates"]) == (4, 7)
+    assert data["test_total_iterations"] == 3
+    assert data["time_sleep_count"] == 3
+
+
+def test_streamed_runs_survive_a_crash(tmp_path):
+    path = tmp_path / "bench.jsonl"
+    sink = benchmark.JsonlSink(path, fsync=True)
+    sink.write("a", record("a", [1, 2]).export())
+    sink.write("b", record("b", [3]).export())
+    sink.close()
+
+    # A run cut off while being written, and one appended after restarting
+    with open(path, "a") as f:
+        f.write('{"id": "c", "data": {"ste')
+    sink = benchmark.JsonlSink(path)
+    sink.write("a", record("a", [4]).export())
+    sink.close()
+
+    benches = benchmark.load_benchmarks(path)
+    assert list(benches) == ["a", "b"]
+    assert benches["a"]["test_total_updates"] == 4
+    assert benches["b"]["values"] == [[3]]
@@ -0,0 +1,57 @@
+import numpy as np
+from certificates import GUESS_FEASIBLE, GUESS_TOO_HIGH, ProbeCertificate
+from main import build_instance, run_ipm
+from tests.test_results import IDK_GRAPH
+from tests.utils import make_edges_and_capacities
+
+
+def solve_idk(guess: int):
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    I, flow = build_instance(edges, capacities, 0, 5, guess)
+    certificate = ProbeCertificate(I, len(edges) + 1)
+    return I, certificate, run_ipm(I, flow, len(edges) + 1, certificate=certificate)
+
+
+def test_certificate_settles_feasible_guess():
+    I, certificate, (flow, verdict) = solve_idk(20)
+
+    # The IPM may converge before the next check
+    assert verdict in (GUESS_FEASIBLE, None)
+    assert certificate.check(flow, 20) == GUESS_FEASIBLE
+    assert certificate.flow_value(flow) > 19
+    assert np.max(np.abs(I.BT_dot(flow))) < 1e-10
+
+
+def test_certificate_settles_infeasible_guess():
+    _, certificate, (flow, verdict) = solve_idk(26)
+
+    assert verdict == GUESS_TOO_HIGH
+    assert 23 <= certificate.cut_bound(flow) < 26
+    lower, upper = certificate.bounds(flow)
+    assert lower <= 23 <= upper < 26
+
+
+def test_no_verdict_at_initial_flow():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    I, flow = build_instance(edges, capacities, 0, 5, 23)
+    certificate = ProbeCertificate(I, len(edges) + 1)
+
+    # The initial flow is half the capacity everywhere, so nothing is
+    # saturated and t is reachable
+    assert certificate.cut_bound(flow) == np.inf
+    assert certificate.check(flow, 23) is None
+
+
+def test_cut_bound_on_a_long_path():
+    n = 2000
+    edges = [(i, i + 1) for i in range(n - 1)] + [(0, n - 1), (n - 2, 1)]
+    capacities = [10] * (n - 1) + [3, 7]
+    I, flow = build_instance(edges, capacities, 0, n - 1, 13)
+    certificate = ProbeCertificate(I, len(edges) + 1)
+    assert certificate.cut_bound(flow) == np.inf
+
+    # Saturate a path edge and the shortcut, and empty the edge back to 1
+    for e in [n // 2, n - 1]:
+        flow[e] = I.u_upper[e]
+    flow[n] = 0
+    assert certificate.cut_bound(flow) == 13
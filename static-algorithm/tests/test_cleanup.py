@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from cleanup import repair_flow, round_circulation
+from min_cost_flow_instance import MinCostFlow
+from tests.test_results import CP_ALGORITHMS_GRAPH, IDK_GRAPH
+from tests.utils import make_edges_and_capacities
+from tests.verifier import assert_flow_is_valid, assert_valid_solution
+
+
+def make_instance(graph, s: int, t: int) -> MinCostFlow:
+    edges, capacities, _ = make_edges_and_capacities(graph)
+    return MinCostFlow.from_max_flow_instance(
+        edges=edges, s=s, t=t, optimal_flow=0, capacities=capacities
+    )
+
+
+def test_repair_fails_far_from_the_max_flow():
+    # The max flow of 23 takes three augmenting paths from the zero flow
+    I = make_instance(IDK_GRAPH, 0, 5)
+    with pytest.raises(RuntimeError):
+        repair_flow(I, np.zeros(I.m), I.m, augmentations=2)
+
+    mf, flows = repair_flow(I, np.zeros(I.m), I.m, augmentations=2, require_max=False)
+    assert mf == 16
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    assert_flow_is_valid(edges, capacities, flows, s=0, t=5)
+
+
+def test_rounding_keeps_conservation():
+    # Half a unit around the cycle 0 -> 1 -> 2 -> 0, and on the parallel edges
+    tail, head = [0, 1, 2, 0, 0], [1, 2, 0, 3, 3]
+    flow = np.array([1.5, 1.5, 0.5, 2.5, 0.5])
+    rounded = round_circulation(tail, head, flow, 4, raise_edge=2)
+
+    assert np.all(rounded == np.round(rounded))
+    assert list(rounded[:3]) == [2, 2, 1]
+    assert rounded[3] + rounded[4] == 3
+
+
+def test_repair_restores_conservation():
+    I = make_instance(CP_ALGORITHMS_GRAPH, 0, 5)
+    # Not conserving at 1 and 2, and above capacity on (0, 1)
+    flow = np.array([7.6, 3.6, 0.2, 4.9, 3.1, 2.0, 3.0, 8.0, 4.6, 0.0])
+    mf, flows = repair_flow(I, flow, I.m)
+
+    assert mf == 10
+    assert_valid_solution(CP_ALGORITHMS_GRAPH, 0, 5, flows, mf)
+
+
+def test_cancel_flow_through_s_and_t():
+    # A flow of value 1 plus flow on cycles through s and through t
+    edges = [(0, 1), (1, 0), (2, 1), (1, 2), (2, 3), (3, 2)]
+    I = make_instance([(e, 5) for e in edges], 0, 2)
+    flow = np.array([3, 2, 4, 5, 2, 2, 0])
+    mf, flows = repair_flow(I, flow, I.m, augmentations=0, require_max=False)
+
+    # Nothing is augmented, and only the cycles go
+    assert mf == 1
+    assert list(flows) == [1, 0, 0, 1, 0, 0]
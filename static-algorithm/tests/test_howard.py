@@ -0,0 +1,122 @@
+import pathlib
+
+import numpy as np
+import pytest
+import benchmark
+import howard
+from feasible_flow import calc_feasible_flow
+from howard import VectorizedHoward, minimum_cycle_ratio
+from main import max_flow_with_guess
+from min_cost_flow_instance import MinCostFlow
+from tests.test_random import INPUT_184, INPUT_51, parse_input
+from tests.test_results import CP_ALGORITHMS_GRAPH, IDK_GRAPH
+from tests.utils import make_edges_and_capacities
+
+
+def initial_state(graph, s: int, t: int, optimal_flow: int):
+    edges, capacities, _ = make_edges_and_capacities(graph)
+    I = MinCostFlow.from_max_flow_instance(
+        edges=edges,
+        s=s,
+        t=t,
+        optimal_flow=optimal_flow,
+        capacities=capacities,
+    )
+    I, flow = calc_feasible_flow(I)
+    return I, I.calc_gradients(flow), I.calc_lengths(flow)
+
+
+@pytest.mark.parametrize(
+    "graph,s,t,optimal_flow",
+    [
+        (CP_ALGORITHMS_GRAPH, 0, 5, 10),
+        (IDK_GRAPH, 0, 5, 23),
+        (*parse_input(INPUT_184), 184),
+        (*parse_input(INPUT_51), 51),
+    ],
+)
+def test_vectorized_matches_python(graph, s: int, t: int, optimal_flow: int):
+    I, gradients, lengths = initial_state(graph, s, t, optimal_flow)
+
+    ratio, cycle = minimum_cycle_ratio(I, gradients, lengths)
+    v_ratio, v_cycle = minimum_cycle_ratio(I, gradients, lengths, vectorized=True)
+
+    assert np.isclose(ratio, v_ratio)
+    assert np.array_equal(cycle.to_dense(I.m), v_cycle.to_dense(I.m))
+
+
+def test_vectorized_cycle_ratio_is_consistent():
+    I, gradients, lengths = initial_state(*parse_input(INPUT_184), 184)
+    ratio, cycle = minimum_cycle_ratio(I, gradients, lengths, vectorized=True)
+
+    assert ratio < 0
+    assert len(np.unique(cycle.edges)) == len(cycle)
+    assert (
+        np.max(np.abs(I.BT_dot(cycle.to_dense(I.m)))) == 0
+    ), "Cycle is not a circulation"
+    assert np.isclose(ratio, -cycle.dot(gradients) / cycle.abs_dot(lengths))
+
+
+def test_warm_start_matches_cold_start():
+    I, gradients, lengths = initial_state(*parse_input(INPUT_51), 51)
+    howard = VectorizedHoward(I, gradients, lengths)
+    _, cycle = howard.find_optimum_cycle_ratio()
+    cold_sweeps = howard.sweeps
+
+    # Move along the cycle and solve again from the previous policy
+    flow = cycle.to_dense(I.m) * 1e-3
+    howard.set_weights(gradients + flow, lengths)
+    warm_ratio, warm_cycle = howard.find_optimum_cycle_ratio()
+
+    cold_ratio, cold_cycle = minimum_cycle_ratio(
+        I, gradients + flow, lengths, vectorized=True
+    )
+    assert np.isclose(warm_ratio, cold_ratio)
+    assert np.array_equal(warm_cycle.to_dense(I.m), cold_cycle.to_dense(I.m))
+    assert howard.sweeps <= cold_sweeps
+
+
+def test_warm_started_ipm_reaches_the_guess():
+    # Distances left from earlier weights once made warm starts stop at a
+    # policy that was not optimal, and the IPM stall far below the guess
+    path = pathlib.Path(__file__).parent.parent / "data" / "dag_edges_250.txt"
+    graph, s, t = parse_input(path.read_text())
+    edges, capacities, _ = make_edges_and_capacities(graph)
+    mf, _ = max_flow_with_guess(
+        edges, capacities, s=s, t=t, optimal_flow=383, cleanup=False
+    )
+    assert mf == 383
+
+
+def test_sparse_cycle_augment():
+    I, gradients, lengths = initial_state(CP_ALGORITHMS_GRAPH, 0, 5, 10)
+    _, cycle = minimum_cycle_ratio(I, gradients, lengths, vectorized=True)
+
+    flow = np.zeros(I.m)
+    cycle.augment(flow, 0.5)
+
+    assert np.array_equal(flow, 0.5 * cycle.to_dense(I.m))
+    assert np.isclose(cycle.dot(gradients), gradients.dot(cycle.to_dense(I.m)))
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_records_sweeps_and_cap_hits(vectorized: bool, monkeypatch):
+    I, gradients, lengths = initial_state(*parse_input(INPUT_184), 184)
+    with benchmark.recording("howard") as run:
+        _, cycle = minimum_cycle_ratio(I, gradients, lengths, vectorized)
+    data = run.export()
+
+    assert data["howard_total_iterations"] == 1
+    assert data["howard_sweep_total_iterations"] == data["howard_total_sweeps"]
+    assert data["howard_sweep_min_switches"] == 0
+    assert data["howard_cycle_length_histogram"] == {len(cycle): 1}
+    assert "howard_cap_hits" not in data
+
+    monkeypatch.setattr(howard, "MAX_ITERATIONS", 1)
+    with benchmark.recording("capped") as run:
+        minimum_cycle_ratio(I, gradients, lengths, vectorized)
+    data = run.export()
+
+    assert data["howard_cap_hits"] == 1
+    assert data["howard_max_sweeps"] == 1
+    assert data["howard_sweep_min_switches"] > 0
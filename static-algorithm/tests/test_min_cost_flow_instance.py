@@ -0,0 +1,206 @@
+import numpy as np
+from feasible_flow import calc_feasible_flow, combinatorial_flow
+from howard import minimum_cycle_ratio
+from min_cost_flow_instance import IncrementalPotential, MinCostFlow, barrier_terms
+from tests.test_random import INPUT_184, parse_input
+from tests.test_results import CP_ALGORITHMS_GRAPH
+from tests.utils import make_edges_and_capacities
+
+
+def make_instance(graph, s: int, t: int, optimal_flow: int) -> MinCostFlow:
+    edges, capacities, lower_capacities = make_edges_and_capacities(graph)
+    return MinCostFlow.from_max_flow_instance(
+        edges=edges,
+        s=s,
+        t=t,
+        optimal_flow=optimal_flow,
+        capacities=capacities,
+        lower_capacities=lower_capacities,
+    )
+
+
+def test_incremental_potential_matches_full_evaluation():
+    I, flow = calc_feasible_flow(make_instance(*parse_input(INPUT_184), 184))
+    potential = IncrementalPotential(I, flow, recompute_interval=1000)
+
+    for _ in range(20):
+        _, cycle = minimum_cycle_ratio(
+            I, potential.gradients, potential.lengths, vectorized=True
+        )
+        step = -0.1 / (50 * cycle.dot(potential.gradients))
+        potential.augment(cycle, step)
+
+        assert np.isclose(potential.cost, I.c.dot(flow))
+        assert np.isclose(potential.phi(), I.phi(flow))
+        assert np.allclose(potential.gradients, I.calc_gradients(flow))
+        assert np.allclose(potential.lengths, I.calc_lengths(flow))
+
+    assert potential.updates == 20
+
+
+def test_incidence_matches_dense_B():
+    I = make_instance(*parse_input(INPUT_184), 184)
+
+    B = np.zeros((I.m, I.n))
+    for e, (a, b) in enumerate(I.edges):
+        B[e, a] = 1
+        B[e, b] = -1
+
+    f = np.arange(I.m, dtype=float)
+    assert np.array_equal(I.BT_dot(f), B.T @ f)
+
+    offsets, edges = I.incidence()
+    for v in range(I.n):
+        touching = [e for e, (a, b) in enumerate(I.edges) if v in (a, b)]
+        assert list(edges[offsets[v] : offsets[v + 1]]) == touching
+
+    vertices = np.array([3, 0, 7])
+    touching, at = I.edges_at(vertices)
+    assert np.all((I.tail[touching] == at) | (I.head[touching] == at))
+    assert list(touching) == [e for v in vertices for e in I.edges_at(v[None])[0]]
+
+
+def test_add_edges_matches_add_edge():
+    bulk = make_instance(CP_ALGORITHMS_GRAPH, 0, 5, 10)
+    single = make_instance(CP_ALGORITHMS_GRAPH, 0, 5, 10)
+    v = bulk.add_vertex()
+    single.add_vertex()
+
+    tails = np.array([v, 1, v, 3])
+    heads = np.array([0, v, 2, v])
+    costs = np.array([5.0, 6.0, 7.0, 8.0])
+    for e in range(len(tails)):
+        single.add_edge(tails[e], heads[e], costs[e], 0, e + 1)
+    new_ids = bulk.add_edges(
+        tails=tails,
+        heads=heads,
+        c=costs,
+        u_lower=np.zeros(4),
+        u_upper=np.arange(1.0, 5.0),
+    )
+
+    assert list(new_ids) == list(range(bulk.m - 4, bulk.m))
+    assert bulk.edges == single.edges
+    assert np.array_equal(bulk.incidence()[1], single.incidence()[1])
+    for name in ["c", "u_lower", "u_upper", "tail", "head"]:
+        assert np.array_equal(getattr(bulk, name), getattr(single, name))
+    assert np.array_equal(
+        bulk.BT_dot(np.ones(bulk.m)), single.BT_dot(np.ones(single.m))
+    )
+
+
+def test_feasible_flow_leaves_instance_unchanged():
+    I = make_instance(*parse_input(INPUT_184), 184)
+    edges = list(I.edges)
+    arrays = {
+        name: getattr(I, name).copy()
+        for name in ["c", "u_lower", "u_upper", "tail", "head"]
+    }
+
+    first, _ = calc_feasible_flow(I)
+    second, _ = calc_feasible_flow(I)
+
+    assert first.m > I.m and first.n == I.n + 1
+    assert first.edges == second.edges
+    assert I.edges == edges
+    for name, values in arrays.items():
+        assert np.array_equal(getattr(I, name), values)
+    a, b = first.edges[-1]
+    assert first.edges_between(b, a) == [first.m - 1]
+
+    # The first overlay appends into the instance's spare room, the second
+    # one finds it used and copies
+    for name in arrays:
+        assert np.shares_memory(getattr(first, name), getattr(I, name))
+        assert not np.shares_memory(getattr(second, name), getattr(I, name))
+
+    # Growing past the spare room doubles the buffers
+    while np.shares_memory(first.c, I.c):
+        m = first.m
+        first.add_edge(a, b, 0, 0, 1)
+    assert all(len(buffer.data) == 2 * m for buffer in first._buffers.values())
+    for name, values in arrays.items():
+        assert np.array_equal(getattr(I, name), values)
+
+
+def test_combinatorial_flow_is_interior():
+    I = make_instance(*parse_input(INPUT_184), 184)
+    start = combinatorial_flow(I, 184)
+    assert np.all(start > I.u_lower) and np.all(start < I.u_upper)
+    assert start[-1] > 0.9 * 184
+
+    extended, flow = calc_feasible_flow(I, start)
+    _, midpoint_flow = calc_feasible_flow(I)
+    assert np.allclose(extended.BT_dot(flow), 0)
+    assert np.all(flow > extended.u_lower) and np.all(flow < extended.u_upper)
+    assert np.sum(flow[I.m :]) < np.sum(midpoint_flow[I.m :])
+
+
+def test_edges_between():
+    I = make_instance(CP_ALGORITHMS_GRAPH, 0, 5, 10)
+    a, b = I.edges[0]
+    expected = [e for e, edge in enumerate(I.edges) if set(edge) == {a, b}]
+
+    assert I.edges_between(a, b) == expected
+    assert I.edges_between(b, a) == expected
+    assert I.edges_between(0, 0) == []
+
+    v = I.add_vertex()
+    I.add_edge(b, a, 0, 0, 1)
+    I.add_edge(a, v, 0, 0, 1)
+    assert I.edges_between(a, b) == expected + [I.m - 2]
+    assert I.edges_between(v, a) == [I.m - 1]
+
+
+def test_repair_conservation():
+    I, flow = calc_feasible_flow(make_instance(*parse_input(INPUT_184), 184))
+    I.add_vertex()  # An isolated vertex is a tree of its own
+
+    rng = np.random.default_rng(0)
+    noisy = flow + rng.normal(0, 1e-8, I.m)
+    assert np.max(np.abs(I.BT_dot(noisy))) > 1e-9
+
+    I.repair_conservation(noisy)
+    assert np.max(np.abs(I.BT_dot(noisy))) < 1e-10
+    assert np.allclose(noisy, flow, rtol=0, atol=1e-6)
+
+
+def test_line_search_helpers():
+    I, flow = calc_feasible_flow(make_instance(*parse_input(INPUT_184), 184))
+    potential = IncrementalPotential(I, flow)
+    _, cycle = minimum_cycle_ratio(
+        I, potential.gradients, potential.lengths, vectorized=True
+    )
+
+    for sign in [1.0, -1.0]:
+        limit = potential.max_step(cycle, sign)
+        moved = flow.copy()
+        cycle.augment(moved, sign * limit)
+        assert np.all(moved >= I.u_lower - 1e-9) and np.all(moved <= I.u_upper + 1e-9)
+        assert np.isclose(np.min(np.minimum(moved - I.u_lower, I.u_upper - moved)), 0)
+
+    expected = potential.phi_after(cycle, -0.5)
+    potential.augment(cycle, -0.5)
+    assert np.isclose(expected, potential.phi())
+    assert np.isclose(expected, I.phi(flow))
+
+
+def test_evaluation_outside_the_bounds():
+    upper_gap = np.array([1.0, 0.0, -1.0, 1e-300])
+    lower_gap = np.array([1.0, 1.0, 1.0, 1.0])
+    with np.errstate(all="raise"):
+        barriers, left, right = barrier_terms(upper_gap, lower_gap, 2.0)
+    assert np.isclose(barriers[0], 2) and np.isclose(left[0], 1)
+    assert np.all(np.isinf(barriers[1:])) and np.all(np.isinf(left[1:]))
+    assert np.array_equal(right, np.ones(4))
+
+    I, flow = calc_feasible_flow(make_instance(*parse_input(INPUT_184), 184))
+    potential = IncrementalPotential(I, flow)
+    _, cycle = minimum_cycle_ratio(
+        I, potential.gradients, potential.lengths, vectorized=True
+    )
+    assert potential.phi_after(cycle, 2 * potential.max_step(cycle)) == np.inf
+    assert potential.phi_after(cycle, -2 * potential.max_step(cycle, -1.0)) == np.inf
+
+    I.optimal_cost = potential.cost
+    assert I.phi(flow) == np.inf
@@ -3,6 +3,7 @@ from flows.capacity_scaling import find_max_flow
 from tests.utils import make_edges_and_capacities
 from tests.verifier import assert_valid_solution
 import pytest
+import benchmark
 
 
 @pytest.mark.slow
@@ -37,6 +38,19 @@ def test_flow_random_dag_517_edges():
     assert_valid_solution(graph, s, t, flows, mf)
 
 
+def test_flow_random_dag_184_needs_the_guess():
+    # Rounding repairs the IPM's flow without augmenting, but it cannot make
+    # up for a wrong guess
+    graph, s, t = parse_input(INPUT_184)
+    edges, capacities, _ = make_edges_and_capacities(graph)
+    with benchmark.recording("cleanup") as run:
+        mf, _ = max_flow_with_guess(edges, capacities, s=s, t=t, optimal_flow=184)
+    assert mf == 184 and run.counters["cleanup_augmentations"] == 0
+
+    with pytest.raises(RuntimeError):
+        max_flow_with_guess(edges, capacities, s=s, t=t, optimal_flow=92)
+
+
 def test_rikos_code():
     edges, s, t = parse_input(INPUT_184)
     edges, capacities, _ = make_edges_and_capacities(edges)
@@ -1,8 +1,15 @@
 import pytest
 import benchmark
-from main import max_flow, max_flow_with_guess
+import numpy as np
+from main import (
+    build_instance,
+    ipm_iterations,
+    max_flow,
+    max_flow_anytime,
+    max_flow_with_guess,
+)
 from tests.utils import make_edges_and_capacities
-from tests.verifier import assert_valid_solution
+from tests.verifier import assert_flow_is_valid, assert_valid_solution
 import utils
 
 
@@ -112,11 +119,135 @@ IDK_GRAPH = [
 ]
 
 
+def test_idk_correct_guess_fixed_step():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    mf, flows = max_flow_with_guess(
+        edges, capacities, s=0, t=5, optimal_flow=23, line_search=False
+    )
+    assert_valid_solution(IDK_GRAPH, 0, 5, flows, mf)
+
+
+def test_idk_correct_guess_combinatorial_start():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    mf, flows = max_flow_with_guess(
+        edges, capacities, s=0, t=5, optimal_flow=23, initial_point="combinatorial"
+    )
+    assert_valid_solution(IDK_GRAPH, 0, 5, flows, mf)
+
+
+def test_idk_correct_guess_large_fixed_step():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    mf, flows = max_flow_with_guess(
+        edges,
+        capacities,
+        s=0,
+        t=5,
+        optimal_flow=23,
+        line_search=False,
+        cleanup=False,
+        upscale=50000,
+    )
+    assert_valid_solution(IDK_GRAPH, 0, 5, flows, mf)
+
+
 def test_idk_binary_search():
     edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
-    mf, flows = max_flow(edges, capacities, s=0, t=5)
+    with benchmark.recording("binary-search") as run:
+        mf, flows = max_flow(edges, capacities, s=0, t=5)
+    assert_valid_solution(IDK_GRAPH, 0, 5, flows, mf)
+
+    # The Howard sweeps of all probes add up, with a cold start per probe
+    data = run.export()
+    probes = sum(1 for probe in data["probe_outcomes"] if probe["iterations"] > 0)
+    assert data["howard_cold_total_iterations"] >= probes > 1
+    assert (
+        data["howard_cold_total_iterations"] + data["howard_warm_total_iterations"]
+        == data["iterations"]
+    )
+
+
+def test_idk_binary_search_without_reusing_flow():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    mf, flows = max_flow(edges, capacities, s=0, t=5, reuse_flow=False)
+    assert_valid_solution(IDK_GRAPH, 0, 5, flows, mf)
+
+
+def test_idk_parallel_search():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    mf, flows = max_flow(edges, capacities, s=0, t=5, workers=3)
+    assert_valid_solution(IDK_GRAPH, 0, 5, flows, mf)
+
+
+def test_parallel_search_with_guesses_below_the_initial_flow():
+    # The initial flow of 2 already exceeds the smallest guess
+    mf, flows = max_flow([(0, 1)], [4], s=0, t=1, workers=2)
+    assert mf == 4 and list(flows) == [4]
+
+
+def test_idk_bounds_search():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    with benchmark.recording("bounds") as run:
+        mf, flows = max_flow(edges, capacities, s=0, t=5, strategy="bounds")
     assert_valid_solution(IDK_GRAPH, 0, 5, flows, mf)
 
+    # The probe aimed at the trivial cut ends with matching bounds, and its
+    # flow needs no augmenting paths
+    assert run.info["binary_search_iters"] == 1
+    assert run.counters["cleanup_augmentations"] == 0
+
+
+def test_bounds_search_runs_alone():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    with pytest.raises(AssertionError):
+        max_flow(edges, capacities, s=0, t=5, strategy="bounds", workers=2)
+    with pytest.raises(AssertionError):
+        max_flow(edges, capacities, s=0, t=5, strategy="bounds", early_stop=False)
+
+
+def test_idk_anytime():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    result = max_flow_anytime(edges, capacities, s=0, t=5, time_budget=60)
+    assert result.optimal and result.lower == result.upper == 23
+    assert_valid_solution(IDK_GRAPH, 0, 5, result.flows, result.value)
+
+
+def test_idk_anytime_out_of_time():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    result = max_flow_anytime(edges, capacities, s=0, t=5, time_budget=0)
+    assert 0 <= result.lower == result.value <= 23 <= result.upper
+    assert result.optimal == (result.value == 23)
+    assert_flow_is_valid(edges, capacities, result.flows, s=0, t=5)
+
+
+def test_fully_connected_anytime_out_of_time():
+    # Every edge into s carries flow at the start, which repair_flow must
+    # not turn into a flow of negative value
+    n = 8
+    edges = [(u, v) for u in range(n) for v in range(n) if u != v]
+    capacities = [(7 * u + v) % 9 + 1 for u, v in edges]
+    result = max_flow_anytime(edges, capacities, s=0, t=n - 1, time_budget=0)
+    assert 0 <= result.lower == result.value <= result.upper
+    assert_flow_is_valid(edges, capacities, result.flows, s=0, t=n - 1)
+
+
+def test_idk_ipm_iterations():
+    edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
+    I, flow = build_instance(edges, capacities, 0, 5, 23)
+    states = []
+    with benchmark.recording("ipm-iterations") as run:
+        iterations = ipm_iterations(I, flow, len(edges) + 1)
+        for state in iterations:
+            states.append(state)
+            if len(states) == 5:
+                break
+        iterations.close()
+
+    assert [state.iteration for state in states] == [1, 2, 3, 4, 5]
+    assert all(a.phi > b.phi and a.gap > b.gap for a, b in zip(states, states[1:]))
+    assert np.isclose(states[-1].gap, I.c.dot(flow) - I.optimal_cost)
+    assert np.all(flow > I.u_lower) and np.all(flow < I.u_upper)
+    assert run.counters["iterations"] == 5
+
 
 def test_idk_correct_guess():
     edges, capacities, _ = make_edges_and_capacities(IDK_GRAPH)
@@ -146,6 +277,21 @@ def test_flow_lower_and_upper_binary_search():
     assert mf == 15
 
 
+def test_flow_lower_and_upper_bounds_search():
+    edges, capacities, lower_capacities = make_edges_and_capacities(
+        FLOW_LOWER_UPPER_GRAPH
+    )
+    mf, _ = max_flow(
+        edges,
+        capacities,
+        s=0,
+        t=5,
+        lower_capacities=lower_capacities,
+        strategy="bounds",
+    )
+    assert mf == 15
+
+
 def test_flow_lower_and_upper_correct_guess():
     edges, capacities, lower_capacities = make_edges_and_capacities(
         FLOW_LOWER_UPPER_GRAPH
@@ -156,6 +302,22 @@ def test_flow_lower_and_upper_correct_guess():
     assert mf == 15
 
 
+def test_flow_lower_and_upper_combinatorial_start():
+    edges, capacities, lower_capacities = make_edges_and_capacities(
+        FLOW_LOWER_UPPER_GRAPH
+    )
+    mf, _ = max_flow_with_guess(
+        edges,
+        capacities,
+        s=0,
+        t=5,
+        lower_capacities=lower_capacities,
+        optimal_flow=15,
+        initial_point="combinatorial",
+    )
+    assert mf == 15
+
+
 def test_thore_fractional_graph_correct_guess():
     graph = [
         ((0, 1), 1),